@@ -0,0 +1,80 @@
+"""
+Admission control for the image pipeline
+Caps the jobs in flight and the queue waiting behind them, rejecting
+excess work fast instead of running out of memory under spikes
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+
+class AdmissionRejected(Exception):
+    """Raised when a job cannot be admitted; carries the suggested retry delay"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounded in-flight slots with a bounded, time-limited wait queue"""
+
+    def __init__(self, max_in_flight, max_queue, queue_timeout, retry_after):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @asynccontextmanager
+    async def admit(self):
+        """Hold a pipeline slot for the duration of the block, or raise AdmissionRejected"""
+        started = time.perf_counter()
+        if self._slots.locked():
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise AdmissionRejected("queue full", self.retry_after)
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout or None)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                self.timed_out += 1
+                raise AdmissionRejected("queue wait timed out", self.retry_after)
+            finally:
+                self.queued -= 1
+        else:
+            await self._slots.acquire()
+
+        waited = time.perf_counter() - started
+        self.admitted += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        self.in_flight += 1
+        try:
+            yield waited
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_avg_ms": round(self.wait_total / self.admitted * 1000, 3) if self.admitted else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+        }
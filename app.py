@@ -1,29 +1,107 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Depends, Query, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-import cv2
-import numpy as np
-from PIL import Image, ImageDraw
-import random
+from fastapi.responses import JSONResponse, PlainTextResponse
 import os
-import io
-import base64
+import asyncio
+import hmac
+import logging
+import signal
+import time
 from typing import Optional
-import math
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager, contextmanager
+from urllib.parse import quote
+
+import config
+import logs
+import metrics
+
+from admission import AdmissionController, AdmissionRejected
+from coalesce import SingleFlight
+from encoding import EncodeOptions, negotiate_format
+from executor import create_executor, run_in_executor, shares_memory, worker_pids
+from logs import sampled, setup_logging, stop_logging
+from pipeline import (
+    PipelineError, asset_registry, inspect_upload, process_upload, render_result, sprite_cache
+)
+from profiler import ProfilerBusy, install_signal_handler, profiler
+from responses import image_response, precondition_response, server_timing
+from result_cache import CachedResult, ResultCache, result_key
+from selection import choose_assets, content_digest, selection_seed
+from sessions import SessionStore
+from uploads import UploadSizeLimit, read_request_body, read_upload
+
+log = logging.getLogger("magadheera")
+
+# Runs the CPU-bound pipeline so the event loop only does I/O
+pipeline_executor = None
+
+# Encoded results by upload hash, chosen assets and output options
+result_cache = ResultCache()
+
+# Identical uploads in flight at the same time, computed once
+single_flight = SingleFlight()
+
+# Decoded frames and landmarks of recent uploads, for /reroll
+sessions = SessionStore()
+
+# Caps concurrent jobs and the queue behind them, rejecting the rest with 503
+admission = AdmissionController(
+    max_in_flight=config.ADMISSION_MAX_IN_FLIGHT or config.PIPELINE_WORKERS or os.cpu_count() or 1,
+    max_queue=config.ADMISSION_MAX_QUEUE,
+    queue_timeout=config.ADMISSION_QUEUE_TIMEOUT,
+    retry_after=config.ADMISSION_RETRY_AFTER
+)
+
+# Caps upload bodies being read, so slow clients wait here without holding a pipeline slot
+upload_admission = AdmissionController(
+    max_in_flight=config.ADMISSION_MAX_UPLOADS,
+    max_queue=config.ADMISSION_MAX_QUEUE,
+    queue_timeout=config.ADMISSION_QUEUE_TIMEOUT,
+    retry_after=config.ADMISSION_RETRY_AFTER
+)
+
+@asynccontextmanager
+async def lifespan(app):
+    global pipeline_executor
+    setup_logging()
+    # SIGUSR2 starts a profile without going through the admin endpoint
+    install_signal_handler()
+    assets = asset_registry.load()
+    source = asset_registry.bundle_path if asset_registry.uses_bundle else "asset folders"
+    log.info("loaded assets", extra={
+        "characters": len(assets.characters), "lovers": len(assets.lovers),
+        "source": source, "kb": assets.nbytes // 1024
+    })
+    # Pick up new or replaced images without a restart
+    asset_registry.start_watching()
+    # Create the pool after loading so forked workers inherit the decoded assets
+    pipeline_executor = create_executor()
+    yield
+    pipeline_executor.shutdown(wait=True)
+    asset_registry.stop_watching()
+    stop_logging()
 
 app = FastAPI(
     title="Magadheera Past Life Reveal API",
     description="Transform faces into epic Magadheera warriors",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Count upload bytes as they arrive, before the multipart body is parsed and spooled.
+# Registered before CORS so its "too large" errors still carry the CORS headers
+app.add_middleware(UploadSizeLimit, path_prefix="/process-image")
+
 # Enable CORS for frontend
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # In production, specify your frontend domain
     allow_credentials=True,
-    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_methods=["GET", "HEAD", "POST", "OPTIONS"],
     allow_headers=["*"],
+    # Response headers a cross-origin frontend reads, beyond the CORS-safelisted ones
+    expose_headers=["X-Session", "X-Character", "X-Lover", "X-Cache", "X-Face-Detection", "ETag", "Server-Timing"],
 )
 
 # Add error handling middleware
@@ -33,359 +111,397 @@ async def error_handling_middleware(request, call_next):
         response = await call_next(request)
         return response
     except Exception as e:
-        print(f"Unhandled error: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return {"error": "Internal server error", "detail": str(e)}
-
-# Initialize OpenCV face detection
-face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
-
-def get_random_character():
-    """Get a random character image from the characters folder"""
-    characters_dir = "characters"
-    if not os.path.exists(characters_dir):
-        return None
-    
-    character_files = [f for f in os.listdir(characters_dir) if f.lower().endswith('.png')]
-    if not character_files:
-        return None
-    
-    random_character = random.choice(character_files)
-    return os.path.join(characters_dir, random_character)
-
-def get_random_lover():
-    """Get a random lover image from the lovers folder"""
-    lovers_dir = "lovers"
-    if not os.path.exists(lovers_dir):
-        return None
-    
-    lover_files = [f for f in os.listdir(lovers_dir) if f.lower().endswith('.png')]
-    if not lover_files:
-        return None
-    
-    random_lover = random.choice(lover_files)
-    return os.path.join(lovers_dir, random_lover)
-
-def calculate_angle(point1, point2):
-    """Calculate angle between two points"""
-    return math.atan2(point2[1] - point1[1], point2[0] - point1[0])
-
-def get_face_landmarks(image):
-    """Extract face landmarks using OpenCV"""
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-    # Detect faces with more sensitive parameters
-    faces = face_cascade.detectMultiScale(
-        gray,
-        scaleFactor=1.05,      # More sensitive scaling
-        minNeighbors=3,        # Fewer neighbors required
-        minSize=(30, 30),      # Smaller minimum face size
-        flags=cv2.CASCADE_SCALE_IMAGE
-    )
-
-    # If no faces found, try with even more sensitive parameters
-    if len(faces) == 0:
-        faces = face_cascade.detectMultiScale(
-            gray,
-            scaleFactor=1.03,
-            minNeighbors=2,
-            minSize=(20, 20),
-            flags=cv2.CASCADE_SCALE_IMAGE
-        )
-
-    if len(faces) == 0:
-        return None
-
-    # Get the largest face
-    face = max(faces, key=lambda x: x[2] * x[3])
-    x, y, w, h = face
-
-    # Extract face region for eye detection
-    face_roi_gray = gray[y:y+h, x:x+w]
-    face_roi_color = image[y:y+h, x:x+w]
-
-    # Detect eyes within the face with multiple attempts
-    eyes = eye_cascade.detectMultiScale(
-        face_roi_gray,
-        scaleFactor=1.05,
-        minNeighbors=3,
-        minSize=(10, 10)
-    )
-
-    # If no eyes found, try more sensitive detection
-    if len(eyes) == 0:
-        eyes = eye_cascade.detectMultiScale(
-            face_roi_gray,
-            scaleFactor=1.03,
-            minNeighbors=2,
-            minSize=(5, 5)
+        log.exception("unhandled error", extra={"path": request.url.path})
+        return JSONResponse(status_code=500, content={"error": "Internal server error", "detail": str(e)})
+
+def encode_options(
+    request: Request,
+    format: Optional[str] = Query(None, description="Output format: jpeg, webp or png (default: from Accept)"),
+    preset: Optional[str] = Query(None, description="Encoding preset: quality, balanced, fast or mobile"),
+    max_dim: Optional[int] = Query(None, description="Downscale so the long edge is at most this many pixels"),
+    progressive: Optional[bool] = Query(None, description="Progressive JPEG"),
+    subsampling: Optional[str] = Query(None, description="JPEG chroma subsampling: 444, 422 or 420")
+):
+    """Resolve the output encoding from query parameters and the Accept header"""
+    try:
+        return EncodeOptions(
+            format=negotiate_format(request.headers.get("accept"), format),
+            preset=preset,
+            max_dim=max_dim,
+            progressive=progressive,
+            subsampling=subsampling
         )
-
-    if len(eyes) < 2:
-        # If we can't detect both eyes, estimate positions based on face proportions
-        left_eye = (x + int(w * 0.3), y + int(h * 0.35))
-        right_eye = (x + int(w * 0.7), y + int(h * 0.35))
-    else:
-        # Sort eyes by x coordinate (left to right)
-        eyes = sorted(eyes, key=lambda e: e[0])
-        left_eye_local = eyes[0]
-        right_eye_local = eyes[-1]
-
-        # Convert to global coordinates and get center points
-        left_eye = (x + left_eye_local[0] + left_eye_local[2]//2,
-                   y + left_eye_local[1] + left_eye_local[3]//2)
-        right_eye = (x + right_eye_local[0] + right_eye_local[2]//2,
-                    y + right_eye_local[1] + right_eye_local[3]//2)
-
-    # Create simplified landmark structure
-    face_landmarks = {
-        'face_rect': (x, y, w, h),
-        'left_eye': left_eye,
-        'right_eye': right_eye,
-        'nose_tip': (x + w//2, y + h//2),
-        'chin': (x + w//2, y + h - h//8)
-    }
-
-    return face_landmarks
-
-def align_and_overlay_face(base_image, character_path, face_landmarks):
-    """Align and overlay character face on detected face"""
-    if not os.path.exists(character_path):
-        return base_image
-
-    # Load character image with transparency
-    character_img = Image.open(character_path).convert("RGBA")
-    base_pil = Image.fromarray(cv2.cvtColor(base_image, cv2.COLOR_BGR2RGB))
-
-    # Get face information from landmarks
-    left_eye = face_landmarks['left_eye']
-    right_eye = face_landmarks['right_eye']
-    nose_tip = face_landmarks['nose_tip']
-    chin = face_landmarks['chin']
-    face_rect = face_landmarks['face_rect']
-
-    # Calculate face dimensions and angle
-    eye_distance = math.sqrt((right_eye[0] - left_eye[0])**2 + (right_eye[1] - left_eye[1])**2)
-    face_width = face_rect[2]
-    face_height = face_rect[3]
-
-    # Calculate rotation angle
-    angle = calculate_angle(left_eye, right_eye)
-    angle_degrees = math.degrees(angle)
-
-    # Improved scaling logic for better face replacement
-    # Scale based on face height for better proportions
-    scale_factor = max(face_width / character_img.width, face_height / character_img.height) * 1.3
-    new_width = int(character_img.width * scale_factor)
-    new_height = int(character_img.height * scale_factor)
-
-    # Ensure minimum size for visibility
-    min_size = 150
-    if new_width < min_size:
-        scale_factor = min_size / character_img.width
-        new_width = min_size
-        new_height = int(character_img.height * scale_factor)
-
-    # Resize character image with high quality
-    character_resized = character_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-    # Rotate character image to match face angle
-    character_rotated = character_resized.rotate(-angle_degrees, expand=True)
-
-    # Improved positioning - center on the entire face area
-    face_center_x = face_rect[0] + face_rect[2] // 2
-    face_center_y = face_rect[1] + face_rect[3] // 2
-
-    # Adjust position slightly upward for better alignment
-    paste_x = face_center_x - character_rotated.width // 2
-    paste_y = face_center_y - character_rotated.height // 2 - int(face_height * 0.1)
-
-    # Ensure paste position is within image bounds
-    paste_x = max(0, min(paste_x, base_pil.width - character_rotated.width))
-    paste_y = max(0, min(paste_y, base_pil.height - character_rotated.height))
-
-    # Create a copy of base image for compositing
-    result = base_pil.copy()
-
-    # Apply character face with improved blending
-    if character_rotated.mode == 'RGBA':
-        # Create a mask for better blending
-        mask = character_rotated.split()[-1]  # Alpha channel
-        result.paste(character_rotated, (paste_x, paste_y), mask)
-    else:
-        # Convert to RGBA and create a simple mask
-        character_rgba = character_rotated.convert('RGBA')
-        result.paste(character_rgba, (paste_x, paste_y))
-
-    return cv2.cvtColor(np.array(result), cv2.COLOR_RGB2BGR)
-
-def add_lover_image(image, lover_path):
-    """Add lover image as a floating element"""
-    if not os.path.exists(lover_path):
-        return image
-
-    lover_img = Image.open(lover_path).convert("RGBA")
-    base_pil = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-
-    # Improved scaling for lover image
-    # Scale based on image size for better proportions
-    base_width, base_height = base_pil.size
-    lover_scale = min(base_width / lover_img.width * 0.25, base_height / lover_img.height * 0.35)
-
-    lover_width = int(lover_img.width * lover_scale)
-    lover_height = int(lover_img.height * lover_scale)
-
-    # Ensure minimum and maximum sizes
-    min_size, max_size = 100, 300
-    if lover_width < min_size:
-        scale_factor = min_size / lover_width
-        lover_width = min_size
-        lover_height = int(lover_height * scale_factor)
-    elif lover_width > max_size:
-        scale_factor = max_size / lover_width
-        lover_width = max_size
-        lover_height = int(lover_height * scale_factor)
-
-    lover_resized = lover_img.resize((lover_width, lover_height), Image.Resampling.LANCZOS)
-
-    # Better positioning - top right with elegant placement
-    margin_x = 30
-    margin_y = 30
-    paste_x = base_pil.width - lover_width - margin_x
-    paste_y = margin_y
-
-    # Ensure position is within bounds
-    paste_x = max(0, min(paste_x, base_pil.width - lover_width))
-    paste_y = max(0, min(paste_y, base_pil.height - lover_height))
-
-    # Apply lover image with transparency
-    if lover_resized.mode == 'RGBA':
-        mask = lover_resized.split()[-1]  # Alpha channel
-        base_pil.paste(lover_resized, (paste_x, paste_y), mask)
-    else:
-        lover_rgba = lover_resized.convert('RGBA')
-        base_pil.paste(lover_rgba, (paste_x, paste_y))
-
-    return cv2.cvtColor(np.array(base_pil), cv2.COLOR_RGB2BGR)
-
-@app.post("/process-image")
-async def process_image(file: UploadFile = File(...)):
-    """Process uploaded image and return Magadheera transformation"""
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def run_pipeline(func, *args):
+    """Run func on the pipeline executor, replacing a process pool that broke
+
+    A worker killed by the OOM killer or a crash in native code breaks the
+    whole pool, so it is rebuilt and the call retried once before giving up
+    with a 503.
+    """
+    global pipeline_executor
+    executor = pipeline_executor
     try:
-        # Validate file
-        if not file.filename:
-            raise HTTPException(status_code=400, detail="No file provided")
-
-        # Check file size (max 10MB)
-        contents = await file.read()
-        if len(contents) > 10 * 1024 * 1024:
-            raise HTTPException(status_code=400, detail="File too large (max 10MB)")
-
-        if len(contents) == 0:
-            raise HTTPException(status_code=400, detail="Empty file")
-
-        # Decode image
-        nparr = np.frombuffer(contents, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-        if image is None:
-            raise HTTPException(status_code=400, detail="Invalid image format. Please use JPG, PNG, or other common formats.")
-
-        # Check image dimensions
-        h, w = image.shape[:2]
-        if w < 50 or h < 50:
-            raise HTTPException(status_code=400, detail="Image too small (minimum 50x50 pixels)")
-
-        if w > 4000 or h > 4000:
-            raise HTTPException(status_code=400, detail="Image too large (maximum 4000x4000 pixels)")
-
-        print(f"Processing image: {w}x{h} pixels")
-
-        # Detect face landmarks
-        face_landmarks = get_face_landmarks(image)
-        using_fallback = False
-
-        if face_landmarks is None:
-            # Fallback: create estimated face landmarks based on image center
-            center_x, center_y = w // 2, h // 2
-            face_size = min(w, h) // 4
-
-            face_landmarks = {
-                'face_rect': (center_x - face_size, center_y - face_size, face_size * 2, face_size * 2),
-                'left_eye': (center_x - face_size//2, center_y - face_size//3),
-                'right_eye': (center_x + face_size//2, center_y - face_size//3),
-                'nose_tip': (center_x, center_y),
-                'chin': (center_x, center_y + face_size//2)
-            }
-            using_fallback = True
-            print("Using fallback face landmarks (no face detected)")
-        else:
-            print("Face detected successfully")
-
-        # Get random character and lover
-        character_path = get_random_character()
-        lover_path = get_random_lover()
-
-        if character_path is None:
-            raise HTTPException(status_code=500, detail="No character images available. Please add character images to the backend.")
-
-        print(f"Using character: {character_path}")
-        if lover_path:
-            print(f"Using lover: {lover_path}")
-
-        # Apply character face overlay
-        result_image = align_and_overlay_face(image, character_path, face_landmarks)
-
-        # Add lover image if available
-        if lover_path:
-            result_image = add_lover_image(result_image, lover_path)
-
-        # Convert result to bytes with high quality
-        encode_params = [
-            cv2.IMWRITE_JPEG_QUALITY, 95,
-            cv2.IMWRITE_JPEG_OPTIMIZE, 1
-        ]
-        success, buffer = cv2.imencode('.jpg', result_image, encode_params)
-
-        if not success:
-            raise HTTPException(status_code=500, detail="Failed to encode result image")
+        return await run_in_executor(executor, func, *args)
+    except BrokenProcessPool:
+        # Concurrent callers see the same broken pool, only the first replaces it
+        if pipeline_executor is executor:
+            log.error("pipeline worker pool broke, starting a new one")
+            pipeline_executor = create_executor()
+            executor.shutdown(wait=False, cancel_futures=True)
+    try:
+        return await run_in_executor(pipeline_executor, func, *args)
+    except BrokenProcessPool:
+        raise PipelineError(503, "Pipeline workers are restarting, please retry shortly")
+
+def result_response(request, key, result, headers=None):
+    """Image response for a pipeline or cached result, with its key as ETag
+
+    A key of None marks a result that does not match its key, which is
+    served with an ETag from its bytes and no /results location.
+    """
+    headers = {
+        "Content-Disposition": f"inline; filename=magadheera_result{result.extension}",
+        "X-Face-Detection": "fallback" if result.using_fallback else "detected",
+        "X-Character": quote(result.character),
+        # Lets a cross-origin frontend read Server-Timing from the Performance API
+        "Timing-Allow-Origin": "*",
+        "Vary": "Accept",
+        **(headers or {})
+    }
+    if result.lover:
+        headers["X-Lover"] = quote(result.lover)
+    if key is not None:
+        headers["Content-Location"] = f"/results/{key}"
 
-        print(f"Processing complete. Result size: {len(buffer)} bytes")
+    # Send the encoded buffer as-is, no BytesIO copy or chunked streaming
+    return image_response(request, result.buffer, result.media_type, headers=headers,
+                          etag=f'"{key}"' if key is not None else None)
 
-        return StreamingResponse(
-            io.BytesIO(buffer.tobytes()),
-            media_type="image/jpeg",
-            headers={
-                "Content-Disposition": "inline; filename=magadheera_result.jpg",
-                "X-Face-Detection": "fallback" if using_fallback else "detected"
-            }
-        )
+SEED_DESCRIPTION = "Pick the character and lover deterministically from this value"
 
+@contextmanager
+def http_errors():
+    """Map pipeline, admission and unexpected failures to HTTP errors"""
+    try:
+        yield
     except HTTPException:
         raise
+    except PipelineError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Server busy ({e.reason}), please retry shortly",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
-        print(f"Unexpected error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("unexpected pipeline error")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+def record_request(endpoint, started, result, cache_status, timings):
+    """Record a served result in the request histogram and a sampled log line"""
+    elapsed = time.perf_counter() - started
+    metrics.REQUEST_SECONDS.observe(elapsed, endpoint, cache_status)
+    if sampled(log):
+        log.info("served result", extra={
+            "endpoint": endpoint,
+            "cache": cache_status,
+            "ms": round(elapsed * 1000, 3),
+            "fallback": result.using_fallback,
+            "character": result.character,
+            "lover": result.lover,
+            "bytes": result.nbytes,
+            "media_type": result.media_type,
+            "stages_ms": {stage: round(ms, 3) for stage, ms in timings.items()},
+        })
+
+def keyed(result, names):
+    """Whether result is exactly the output its key names, so it can be cached
+
+    Not so when a worker whose snapshot lacks a chosen asset rendered a
+    random one instead, or when the detection budget cut detection short,
+    since the next run may find the face.
+    """
+    return (result.character, result.lover) == names and not result.budget_cut
+
+async def cached_result(key, compute, kind, names):
+    """Result for key from the cache, a run already in flight, or compute()
+
+    Returns (result, analysis, timings, cache status), where analysis is the
+    frame, landmarks and fallback flag of a pipeline run that kept them and
+    timings are the run's stage times, empty on a cache hit. names are the
+    chosen character and lover, see keyed(). Only compute() runs under an
+    admission slot, so it may raise AdmissionRejected for every caller.
+    """
+    # A hit skips decode, detection, compositing and encoding entirely
+    result = await asyncio.to_thread(result_cache.get, key) if result_cache.enabled else None
+    if result is not None:
+        return result, None, {}, "hit"
+
+    async def run():
+        # Only the leader waits for a pipeline slot, hits and followers never take one
+        async with admission.admit() as waited:
+            metrics.STAGE_SECONDS.observe(waited, "queue_wait")
+            output = await compute()
+        metrics.PIPELINE_RUNS.inc(kind)
+        metrics.observe_stages(output.timings)
+        if kind == "upload" and output.using_fallback:
+            metrics.FALLBACK_LANDMARKS.inc()
+        computed = CachedResult.from_result(output)
+        if result_cache.enabled and keyed(computed, names):
+            await asyncio.to_thread(result_cache.put, key, computed)
+        analysis = None
+        if output.frame is not None:
+            analysis = (output.frame, output.landmarks, output.using_fallback, output.budget_cut)
+        return computed, analysis, output.timings
+
+    # Identical uploads arriving together share a single pipeline run
+    (result, analysis, timings), joined = await single_flight.run(key, run)
+    return result, analysis, timings, "coalesced" if joined else "miss"
+
+async def handle_upload(request, read_body, options, seed=None):
+    """Read, admit and process one upload, mapping failures to HTTP errors"""
+    started = time.perf_counter()
+    with http_errors():
+        async with upload_admission.admit():
+            # Read incrementally, aborting as soon as the size limit is crossed
+            read_started = time.perf_counter()
+            contents = await read_body()
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - read_started, "upload_read")
+
+        # Header-only format and size check, so bad uploads never reach a worker
+        info = inspect_upload(contents)
+
+        # Hash off the event loop since uploads can be megabytes
+        digest = await asyncio.to_thread(content_digest, contents)
+
+        # Pick the character and lover from the seed or the upload's hash
+        seed = selection_seed(seed, digest)
+        character, lover = choose_assets(asset_registry.snapshot(), seed)
+        names = (character.name if character else None, lover.name if lover else None)
+
+        # Rerolls of this upload reuse its decoded frame and landmarks
+        session = sessions.create(digest, contents, info, seed, names[0]) if sessions.enabled else None
+        extra_headers = {"X-Session": session.id} if session else {}
+
+        # The key names the exact output, so it doubles as the ETag; a POST whose
+        # If-None-Match already holds it fails with 412 before any processing
+        key = result_key(digest, character, lover, options)
+        response = precondition_response(request, f'"{key}"', {"Vary": "Accept", **extra_headers})
+        if response is not None:
+            return response
+
+        # Decode, detect, composite and encode off the event loop, keeping the
+        # frame only when it comes back free, process workers would pickle it
+        keep_frame = session is not None and shares_memory(pipeline_executor)
+        result, analysis, timings, cache_status = await cached_result(key, lambda: run_pipeline(
+            process_upload, contents, info, options, *names, keep_frame
+        ), "upload", names)
+        if session and analysis:
+            session.attach(*analysis)
+            sessions.touch(session)
+
+        record_request("process-image", started, result, cache_status, timings)
+        return result_response(request, key if keyed(result, names) else None, result, {
+            "X-Cache": cache_status,
+            "Server-Timing": server_timing(timings, cache_status),
+            **extra_headers
+        })
+
+async def handle_reroll(request, session_id, options):
+    """Render an earlier upload with another character, skipping decode and detection"""
+    session = sessions.get(session_id) if sessions.enabled else None
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+
+    started = time.perf_counter()
+    with http_errors():
+        # Another character than the ones this upload was already shown with
+        assets = asset_registry.snapshot()
+        character, lover = choose_assets(assets, session.next_seed(), exclude=session.seen)
+        names = (character.name if character else None, lover.name if lover else None)
+        if character:
+            session.shown(character.name, len(assets.characters))
+
+        key = result_key(session.digest, character, lover, options)
+        extra_headers = {"X-Session": session.id}
+        response = precondition_response(request, f'"{key}"', {"Vary": "Accept", **extra_headers})
+        if response is not None:
+            return response
+
+        if session.analyzed:
+            # Only selection, compositing and encoding are redone
+            compute = lambda: run_pipeline(
+                render_result,
+                session.frame, session.landmarks, session.using_fallback, options, *names,
+                session.budget_cut
+            )
+        else:
+            # Served from the cache or by a process pool, so analyze the upload
+            # now, keeping the frame when that is cheap
+            compute = lambda: run_pipeline(
+                process_upload, session.contents, session.info, options, *names,
+                shares_memory(pipeline_executor)
+            )
+        result, analysis, timings, cache_status = await cached_result(key, compute, "reroll", names)
+        if analysis and not session.analyzed:
+            session.attach(*analysis)
+            sessions.touch(session)
+
+        record_request("reroll", started, result, cache_status, timings)
+        return result_response(request, key if keyed(result, names) else None, result, {
+            "X-Cache": cache_status,
+            "Server-Timing": server_timing(timings, cache_status),
+            **extra_headers
+        })
+
+@app.post("/process-image")
+async def process_image(request: Request, file: UploadFile = File(...),
+                        options: EncodeOptions = Depends(encode_options),
+                        seed: Optional[str] = Query(None, description=SEED_DESCRIPTION)):
+    """Process uploaded image and return Magadheera transformation"""
+    # Validate file
+    if not file.filename:
+        raise HTTPException(status_code=400, detail="No file provided")
+
+    return await handle_upload(request, lambda: read_upload(file), options, seed)
+
+@app.post("/process-image/raw")
+async def process_image_raw(request: Request, options: EncodeOptions = Depends(encode_options),
+                            seed: Optional[str] = Query(None, description=SEED_DESCRIPTION)):
+    """Process an image sent as the raw request body, skipping multipart parsing"""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type != "application/octet-stream" and not content_type.startswith("image/"):
+        raise HTTPException(status_code=415, detail="Send the image as application/octet-stream or image/*")
+
+    return await handle_upload(request, lambda: read_request_body(request), options, seed)
+
+@app.post("/reroll/{session_id}")
+async def reroll(request: Request, session_id: str, options: EncodeOptions = Depends(encode_options)):
+    """Show the upload behind a session as another character"""
+    return await handle_reroll(request, session_id, options)
+
+@app.api_route("/results/{key}", methods=["GET", "HEAD"])
+async def get_result(request: Request, key: str):
+    """Serve a previously processed result by its key, as given in Content-Location"""
+    if not result_cache.enabled or not key.isalnum():
+        raise HTTPException(status_code=404, detail="Result not found")
+    result = await asyncio.to_thread(result_cache.get, key)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Result not found")
+    return result_response(request, key, result, {
+        "X-Cache": "hit",
+        "Server-Timing": server_timing({}, "hit")
+    })
+
 @app.get("/")
 async def root():
     return {"message": "Magadheera Past Life Reveal API is running!"}
 
 @app.get("/health")
 async def health_check():
-    characters_count = len([f for f in os.listdir("characters") if f.lower().endswith('.png')]) if os.path.exists("characters") else 0
-    lovers_count = len([f for f in os.listdir("lovers") if f.lower().endswith('.png')]) if os.path.exists("lovers") else 0
-    
+    assets = asset_registry.snapshot()
+
     return {
         "status": "healthy",
-        "characters_available": characters_count,
-        "lovers_available": lovers_count
+        "characters_available": len(assets.characters),
+        "lovers_available": len(assets.lovers),
+        "sprite_cache": sprite_cache.stats(),
+        "result_cache": result_cache.stats(),
+        "coalescing": single_flight.stats(),
+        "sessions": sessions.stats(),
+        "admission": admission.stats(),
+        "upload_admission": upload_admission.stats(),
+        "logging": logs.stats()
     }
 
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Allow admin endpoints only with the configured ADMIN_TOKEN"""
+    if not config.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, config.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def start_profile(
+    seconds: float = Query(None, description="How long to sample (default PROFILE_SECONDS)"),
+    interval_ms: float = Query(None, description="Time between stack samples"),
+    format: str = Query(None, description="speedscope or collapsed")
+):
+    """Sample all threads of this process, and any pipeline worker processes, into a profile file"""
+    try:
+        path = profiler.start(seconds, interval_ms, format)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Worker processes profile themselves with the configured defaults on SIGUSR2
+    workers = worker_pids(pipeline_executor)
+    for pid in workers:
+        os.kill(pid, signal.SIGUSR2)
+    return {"path": path, "seconds": seconds or config.PROFILE_SECONDS, "workers_signalled": workers}
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def profile_status():
+    return {"running": profiler.running, "last_path": profiler.last_path}
+
+def runtime_gauges():
+    """Queue depth, cache and fallback gauges for /metrics"""
+    queue = admission.stats()
+    results = result_cache.stats()
+    sprites = sprite_cache.stats()
+    session_stats = sessions.stats()
+    runs = metrics.PIPELINE_RUNS.value("upload")
+    fallbacks = metrics.FALLBACK_LANDMARKS.value()
+    # Process workers keep their own sprite caches, this process's one sits unused
+    local_sprites = shares_memory(pipeline_executor)
+    return [
+        ("admission_in_flight", "Pipeline jobs running", queue["in_flight"]),
+        ("admission_queued", "Requests waiting for a pipeline slot", queue["queued"]),
+        ("cache_hit_ratio", "Hit ratio of each cache since start", [
+            ({"cache": "result"}, results["hit_ratio"]),
+        ] + ([({"cache": "sprite"}, sprites["hit_ratio"])] if local_sprites else [])),
+        ("cache_bytes", "Bytes held by each cache", [
+            ({"cache": "result"}, results["bytes"]),
+            ({"cache": "result_disk"}, results["disk"]["bytes"]),
+            ({"cache": "session"}, session_stats["bytes"]),
+        ] + ([({"cache": "sprite"}, sprites["bytes"])] if local_sprites else [])),
+        ("sessions_active", "Live reroll sessions", session_stats["entries"]),
+        ("fallback_rate", "Share of uploads processed with estimated landmarks", fallbacks / runs if runs else 0.0),
+    ]
+
+def runtime_counters():
+    """Rejection, eviction and coalescing counts for /metrics"""
+    results = result_cache.stats()
+    session_stats = sessions.stats()
+    return [
+        ("admission_rejected", "Requests rejected with 503", [
+            ({"queue": "pipeline"}, admission.rejected),
+            ({"queue": "upload"}, upload_admission.rejected),
+        ]),
+        ("cache_evictions", "Entries evicted from each cache", [
+            ({"cache": "result"}, results["evictions"]),
+            ({"cache": "result_disk"}, results["disk"]["evictions"]),
+            ({"cache": "session"}, session_stats["evictions"]),
+        ] + ([({"cache": "sprite"}, sprite_cache.evictions)] if shares_memory(pipeline_executor) else [])),
+        ("coalesced_requests", "Requests that joined a pipeline run already in flight", single_flight.followers),
+        ("log_records_dropped", "Log records dropped because the log queue was full",
+         logs.stats()["dropped"]),
+    ]
+
+metrics.GaugeCollector(runtime_gauges)
+metrics.CounterCollector(runtime_counters)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus text exposition of stage timings, queue depth and cache ratios"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Leave logging to setup_logging, uvicorn's default config writes to stdout synchronously
+    uvicorn.run(app, host="0.0.0.0", port=8000, log_config=None)
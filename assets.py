@@ -0,0 +1,367 @@
+"""
+In-memory asset registry for character and lover images
+Decodes every PNG once so requests never touch the disk, and hot-reloads
+the folders in the background when artists add or replace images.
+Assets can also be served from a packed bundle of premultiplied BGRA
+pyramid levels that every worker process maps read-only and composites
+from directly, instead of decoding and premultiplying PNGs.
+"""
+
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+import struct
+import threading
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import config
+from compositing import premultiply
+
+# Smallest pyramid level kept, in pixels along the shorter side
+PYRAMID_MIN_SIDE = 32
+
+log = logging.getLogger(__name__)
+
+_asset_ids = itertools.count()
+
+
+def build_pyramid(bgra):
+    """Return successively halved copies of a premultiplied BGRA array, largest first"""
+    levels = [bgra]
+    while min(levels[-1].shape[:2]) // 2 >= PYRAMID_MIN_SIDE:
+        height, width = levels[-1].shape[:2]
+        # Averaging premultiplied pixels keeps transparent edges free of halos
+        levels.append(cv2.resize(levels[-1], (width // 2, height // 2), interpolation=cv2.INTER_AREA))
+    return levels
+
+
+class Asset:
+    """A decoded character or lover image
+
+    Built from straight RGBA pixels, or from premultiplied BGRA pyramid
+    levels, e.g. mapped from a bundle, in which case rgba is None.
+    """
+
+    def __init__(self, kind, name, rgba=None, pyramid=None, digest=None):
+        self.kind = kind
+        self.name = name
+        self.rgba = rgba
+        self.height, self.width = (rgba if rgba is not None else pyramid[0]).shape[:2]
+        # Unique per decode, so cached renders of a replaced file are never reused
+        self.uid = next(_asset_ids)
+        self._pyramid = list(pyramid) if pyramid else None
+        self._premultiplied = self._pyramid[0] if self._pyramid else None
+        self._digest = digest
+
+    @property
+    def premultiplied(self):
+        """Premultiplied BGRA pixels used for compositing, built on first use"""
+        if self._premultiplied is None:
+            self._premultiplied = premultiply(self.rgba)
+        return self._premultiplied
+
+    @property
+    def pyramid(self):
+        """Premultiplied mip levels of the asset, built on first use"""
+        if self._pyramid is None:
+            self._pyramid = build_pyramid(self.premultiplied)
+        return self._pyramid
+
+    def level_for(self, width, height):
+        """Smallest pyramid level that is still at least width x height"""
+        best = self.pyramid[0]
+        for level in self.pyramid[1:]:
+            if level.shape[1] < width or level.shape[0] < height:
+                break
+            best = level
+        return best
+
+    @property
+    def digest(self):
+        """Hash of the pixels, stable across reloads, processes and restarts"""
+        if self._digest is None:
+            source = self.rgba if self.rgba is not None else self.premultiplied
+            pixels = hashlib.blake2b(np.ascontiguousarray(source), digest_size=8)
+            pixels.update(f"{self.width}x{self.height}".encode())
+            self._digest = pixels.hexdigest()
+        return self._digest
+
+    @property
+    def nbytes(self):
+        if self.rgba is not None:
+            return self.rgba.nbytes
+        return sum(level.nbytes for level in self.pyramid)
+
+    def __repr__(self):
+        return f"Asset({self.kind}/{self.name}, {self.width}x{self.height})"
+
+
+def decode_asset(kind, path):
+    """Decode a PNG from disk into an Asset"""
+    with Image.open(path) as img:
+        rgba = np.asarray(img.convert("RGBA"))
+    name = os.path.splitext(os.path.basename(path))[0]
+    return Asset(kind, name, rgba)
+
+
+def fit_to_canvas(img, target_size):
+    """Scale an image to fit target_size and centre it on a transparent canvas"""
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+    img.thumbnail(target_size, Image.Resampling.LANCZOS)
+    canvas = Image.new('RGBA', target_size, (0, 0, 0, 0))
+    x = (target_size[0] - img.width) // 2
+    y = (target_size[1] - img.height) // 2
+    canvas.paste(img, (x, y), img)
+    return canvas
+
+
+def scan_folder(folder):
+    """Map each PNG in an asset folder to its (mtime, size) signature"""
+    signature = {}
+    if not os.path.exists(folder):
+        return signature
+    for entry in os.scandir(folder):
+        if entry.is_file() and entry.name.lower().endswith('.png'):
+            stat = entry.stat()
+            signature[entry.path] = (stat.st_mtime_ns, stat.st_size)
+    return signature
+
+
+class AssetSet:
+    """An immutable set of decoded characters and lovers"""
+
+    def __init__(self, characters, lovers):
+        self.characters = tuple(characters)
+        self.lovers = tuple(lovers)
+        self._by_name = {}
+        for asset in self.characters + self.lovers:
+            self._by_name[(asset.kind, asset.name)] = asset
+
+    def get(self, kind, name):
+        return self._by_name.get((kind, name))
+
+    def random_character(self):
+        return random.choice(self.characters) if self.characters else None
+
+    def random_lover(self):
+        return random.choice(self.lovers) if self.lovers else None
+
+    @property
+    def nbytes(self):
+        return sum(asset.nbytes for asset in self.characters + self.lovers)
+
+
+# Bundle layout: magic, index length, JSON index, then page-aligned pixel data
+# holding each asset's premultiplied BGRA pyramid, largest level first
+BUNDLE_MAGIC = b"MGDBNDL2"
+BUNDLE_HEADER = struct.Struct("<8sQ")
+BUNDLE_PAGE = 4096
+BUNDLE_ALIGN = 64
+
+
+def _align(offset, alignment):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def pack_bundle(asset_set, path):
+    """Write an AssetSet to a bundle file, replacing any existing one atomically"""
+    assets = asset_set.characters + asset_set.lovers
+    index = []
+    offset = 0
+    for asset in assets:
+        levels = []
+        for level in asset.pyramid:
+            height, width = level.shape[:2]
+            levels.append({"width": width, "height": height, "offset": offset})
+            offset = _align(offset + level.nbytes, BUNDLE_ALIGN)
+        index.append({
+            "kind": asset.kind,
+            "name": asset.name,
+            # Digest of the source pixels, so result cache keys match the asset folders
+            "digest": asset.digest,
+            "levels": levels,
+        })
+
+    index_bytes = json.dumps(index).encode("utf-8")
+    data_start = _align(BUNDLE_HEADER.size + len(index_bytes), BUNDLE_PAGE)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(BUNDLE_HEADER.pack(BUNDLE_MAGIC, len(index_bytes)))
+        f.write(index_bytes)
+        for entry, asset in zip(index, assets):
+            for level_entry, level in zip(entry["levels"], asset.pyramid):
+                f.seek(data_start + level_entry["offset"])
+                f.write(np.ascontiguousarray(level, dtype=np.uint8).tobytes())
+        f.truncate(data_start + offset)
+    # Workers still mapping the old file keep its inode until they remap
+    os.replace(tmp_path, path)
+    return len(assets), data_start + offset
+
+
+def load_bundle(path):
+    """Map a bundle file read-only and return its AssetSet without copying pixels"""
+    with open(path, "rb") as f:
+        magic, index_len = BUNDLE_HEADER.unpack(f.read(BUNDLE_HEADER.size))
+        if magic != BUNDLE_MAGIC:
+            raise ValueError(f"{path} is not an asset bundle of this version, rebuild it with build_asset_bundle.py")
+        index = json.loads(f.read(index_len).decode("utf-8"))
+    data_start = _align(BUNDLE_HEADER.size + index_len, BUNDLE_PAGE)
+
+    mapped = np.memmap(path, dtype=np.uint8, mode="r")
+    loaded = {"character": [], "lover": []}
+    for entry in index:
+        pyramid = []
+        for level in entry["levels"]:
+            width, height = level["width"], level["height"]
+            start = data_start + level["offset"]
+            pyramid.append(mapped[start:start + width * height * 4].reshape(height, width, 4))
+        loaded[entry["kind"]].append(Asset(entry["kind"], entry["name"], pyramid=pyramid, digest=entry["digest"]))
+    return AssetSet(loaded["character"], loaded["lover"])
+
+
+class AssetRegistry:
+    """Holds the current AssetSet and swaps in rebuilt sets atomically
+
+    Requests should call snapshot() once and pick from the returned set,
+    so a reload that lands mid-request never mixes old and new assets.
+    """
+
+    def __init__(self, characters_dir=None, lovers_dir=None, bundle_path=None):
+        self.folders = {
+            "character": characters_dir or config.CHARACTERS_DIR,
+            "lover": lovers_dir or config.LOVERS_DIR,
+        }
+        self.bundle_path = config.ASSET_BUNDLE if bundle_path is None else bundle_path
+        self._assets = AssetSet([], [])
+        self._decoded = {}  # path -> (signature, Asset), reused across reloads
+        self._signature = None
+        self._stale_folders = []
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        """Forked children inherit the watcher's Thread object but not the thread"""
+        self._watcher = None
+        self._stop = threading.Event()
+        # The watcher may have held the lock at fork time, leaving it locked forever
+        self._reload_lock = threading.Lock()
+
+    @property
+    def uses_bundle(self):
+        return bool(self.bundle_path) and os.path.exists(self.bundle_path)
+
+    def _scan(self):
+        if self.uses_bundle:
+            stat = os.stat(self.bundle_path)
+            return {"bundle": (stat.st_ino, stat.st_mtime_ns, stat.st_size)}
+        return {kind: scan_folder(folder) for kind, folder in self.folders.items()}
+
+    def _check_bundle(self, signature):
+        """Warn once per change when the asset folders were edited after the bundle was built
+
+        The folders are not read while a bundle exists, so new or replaced
+        images only show up once the bundle is rebuilt.
+        """
+        if "bundle" not in signature:
+            return
+        bundle_mtime = signature["bundle"][1]
+        stale = []
+        for folder in self.folders.values():
+            if not os.path.isdir(folder):
+                continue
+            # The folder's own mtime covers added, removed and renamed files
+            changed = [os.stat(folder).st_mtime_ns] + [mtime for mtime, _ in scan_folder(folder).values()]
+            if max(changed) > bundle_mtime:
+                stale.append(folder)
+        if stale and stale != self._stale_folders:
+            log.warning("asset folders changed after the bundle was built, run build_asset_bundle.py to include them",
+                        extra={"bundle": self.bundle_path, "folders": stale})
+        self._stale_folders = stale
+
+    def _build(self, signature):
+        """Build a new AssetSet, decoding only files that changed"""
+        if "bundle" in signature:
+            self._decoded = {}
+            return load_bundle(self.bundle_path)
+
+        decoded = {}
+        loaded = {}
+        for kind, files in signature.items():
+            assets = []
+            for path in sorted(files):
+                cached = self._decoded.get(path)
+                if cached and cached[0] == files[path]:
+                    asset = cached[1]
+                else:
+                    try:
+                        asset = decode_asset(kind, path)
+                    except Exception as e:
+                        log.warning("skipping unreadable asset", extra={"kind": kind, "path": path, "error": str(e)})
+                        continue
+                decoded[path] = (files[path], asset)
+                assets.append(asset)
+            loaded[kind] = assets
+        self._decoded = decoded
+        return AssetSet(loaded["character"], loaded["lover"])
+
+    def load(self):
+        """Load all assets from the bundle or the folders and publish them"""
+        with self._reload_lock:
+            signature = self._scan()
+            self._assets = self._build(signature)
+            self._signature = signature
+            self._check_bundle(signature)
+        return self._assets
+
+    def reload_if_changed(self):
+        """Rebuild and swap the asset set if any folder changed, return True if it did"""
+        with self._reload_lock:
+            signature = self._scan()
+            self._check_bundle(signature)
+            if signature == self._signature:
+                return False
+            # Single reference assignment, in-flight snapshots stay valid
+            self._assets = self._build(signature)
+            self._signature = signature
+        assets = self._assets
+        log.info("reloaded assets", extra={"characters": len(assets.characters), "lovers": len(assets.lovers)})
+        return True
+
+    def snapshot(self):
+        return self._assets
+
+    def start_watching(self, interval=None):
+        """Poll the asset folders, or the bundle and the folders behind it, in a background thread"""
+        interval = config.ASSET_POLL_INTERVAL if interval is None else interval
+        if interval <= 0 or (self._watcher is not None and self._watcher.is_alive()):
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(
+            target=self._watch, args=(interval,), name="asset-watcher", daemon=True
+        )
+        self._watcher.start()
+
+    def stop_watching(self):
+        if self._watcher is None:
+            return
+        self._stop.set()
+        self._watcher.join()
+        self._watcher = None
+
+    def _watch(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.reload_if_changed()
+            except Exception:
+                log.exception("asset reload failed")
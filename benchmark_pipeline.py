@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Offline benchmarks for the Magadheera image pipeline
+Imports the pipeline functions directly, no running server needed
+
+    python benchmark_pipeline.py overlay
+    python benchmark_pipeline.py detection --caps 0 640 960
+    python benchmark_pipeline.py --repeat 10 --json stages.json stages
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import statistics
+import time
+
+import cv2
+import numpy as np
+
+import pipeline
+from assets import Asset, build_pyramid
+from detection import get_face_landmarks
+from encoding import EncodeOptions, encode_image
+
+SAMPLE_IMAGES = ["test_face.jpg", "pipeline_test.jpg", "realistic_face_test.jpg"]
+
+
+def time_call(func, repeat):
+    """Run func repeat times and return the durations in milliseconds"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(len(ordered) * fraction) - 1))]
+
+
+def summarize(durations):
+    """Median and tail latency of a list of durations"""
+    ordered = sorted(durations)
+    return {
+        "runs": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered), 3),
+        "min_ms": round(ordered[0], 3),
+        "p50_ms": round(percentile(ordered, 0.50), 3),
+        "p90_ms": round(percentile(ordered, 0.90), 3),
+        "p95_ms": round(percentile(ordered, 0.95), 3),
+        "p99_ms": round(percentile(ordered, 0.99), 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+
+def synthetic_landmarks(width, height, face_size, angle_degrees):
+    """Landmarks for a face of face_size pixels centred in the frame"""
+    center_x, center_y = width // 2, height // 2
+    half_eyes = face_size * 0.2
+    dx = half_eyes * np.cos(np.radians(angle_degrees))
+    dy = half_eyes * np.sin(np.radians(angle_degrees))
+    return {
+        'face_rect': (center_x - face_size // 2, center_y - face_size // 2, face_size, face_size),
+        'left_eye': (int(center_x - dx), int(center_y - face_size * 0.15 - dy)),
+        'right_eye': (int(center_x + dx), int(center_y - face_size * 0.15 + dy)),
+        'nose_tip': (center_x, center_y),
+        'chin': (center_x, center_y + face_size // 2),
+    }
+
+
+def bench_overlay(args):
+    """Compare the cached and single-warp character placement paths"""
+    assets = pipeline.asset_registry.load()
+    character = assets.characters[0]
+    frame = np.full((args.height, args.width, 3), 127, np.uint8)
+
+    results = []
+    for face_size in args.face_sizes:
+        for angle in args.angles:
+            landmarks = synthetic_landmarks(args.width, args.height, face_size, angle)
+            row = {"face_size": face_size, "angle": angle}
+
+            pipeline.sprite_cache.clear()
+            row["cached_cold"] = summarize(time_call(
+                lambda: (pipeline.sprite_cache.clear(),
+                         pipeline.align_and_overlay_face(frame, character, landmarks, copy=False, mode="cached")),
+                args.repeat))
+            row["cached_warm"] = summarize(time_call(
+                lambda: pipeline.align_and_overlay_face(frame, character, landmarks, copy=False, mode="cached"),
+                args.repeat))
+            row["warp"] = summarize(time_call(
+                lambda: pipeline.align_and_overlay_face(frame, character, landmarks, copy=False, mode="warp"),
+                args.repeat))
+            results.append(row)
+
+            print(f"face {face_size:4d}px angle {angle:5.1f}: "
+                  f"cached cold {row['cached_cold']['p50_ms']:7.3f} ms, "
+                  f"cached warm {row['cached_warm']['p50_ms']:7.3f} ms, "
+                  f"warp {row['warp']['p50_ms']:7.3f} ms")
+    return results
+
+
+def box_iou(a, b):
+    """Intersection over union of two (x, y, w, h) boxes"""
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    inter = max(0, x1 - x0) * max(0, y1 - y0)
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / union if union else 0.0
+
+
+def resize_long_edge(image, long_edge):
+    height, width = image.shape[:2]
+    scale = long_edge / max(width, height)
+    return cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_CUBIC)
+
+
+def bench_detection(args):
+    """Speed and recall of downscaled face detection for each long-edge cap"""
+    results = []
+    for path in args.images:
+        original = cv2.imread(path)
+        if original is None:
+            print(f"Skipping unreadable image {path}")
+            continue
+        for size in args.sizes:
+            image = resize_long_edge(original, size)
+            reference = get_face_landmarks(image, max_edge=0)
+            for cap in args.caps:
+                landmarks = get_face_landmarks(image, max_edge=cap)
+                row = {
+                    "image": path,
+                    "long_edge": size,
+                    "cap": cap,
+                    "found": landmarks is not None,
+                    "reference_found": reference is not None,
+                    "iou": round(box_iou(landmarks['face_rect'], reference['face_rect']), 3)
+                    if landmarks and reference else None,
+                    "timing": summarize(time_call(lambda: get_face_landmarks(image, max_edge=cap), args.repeat)),
+                }
+                results.append(row)
+                print(f"{path} @ {size:4d}px cap {cap or 'full':>4}: "
+                      f"{row['timing']['p50_ms']:8.2f} ms, found={row['found']}, iou={row['iou']}")
+
+    print("\nSummary per cap:")
+    for cap in args.caps:
+        rows = [r for r in results if r["cap"] == cap]
+        with_face = [r for r in rows if r["reference_found"]]
+        recall = sum(r["found"] for r in with_face) / len(with_face) if with_face else None
+        p50 = statistics.median(r["timing"]["p50_ms"] for r in rows) if rows else 0.0
+        print(f"  cap {cap or 'full':>4}: median p50 {p50:8.2f} ms, recall vs full resolution {recall}")
+    return results
+
+
+def parse_size(text):
+    """'1280x720' -> (1280, 720)"""
+    width, _, height = text.lower().partition("x")
+    return int(width), int(height)
+
+
+def sample_face(path):
+    """The face found in a sample image, as a BGR crop"""
+    image = cv2.imread(path)
+    if image is None:
+        raise SystemExit(f"Cannot read sample face image {path}")
+    landmarks = get_face_landmarks(image, max_edge=0)
+    if landmarks is None:
+        raise SystemExit(f"No face found in {path}, pass another --face-image")
+    x, y, w, h = landmarks['face_rect']
+    # Keep some context around the face so the eye and face cascades still fire
+    pad = int(0.35 * max(w, h))
+    y0, x0 = max(0, y - pad), max(0, x - pad)
+    return image[y0:y + h + pad, x0:x + w + pad]
+
+
+def synthetic_frame(width, height, face, face_count, rng):
+    """A smoothly shaded frame with face_count copies of a face laid out on a grid"""
+    # Coarse colour blobs scaled up, like an out-of-focus background; fine
+    # noise would make the cascades chase texture no real photo has
+    blobs = rng.integers(0, 256, (4, max(1, round(4 * width / height)), 3), dtype=np.uint8)
+    frame = cv2.resize(blobs, (width, height), interpolation=cv2.INTER_CUBIC)
+    if face_count == 0:
+        return frame
+
+    columns = math.ceil(math.sqrt(face_count))
+    rows = math.ceil(face_count / columns)
+    cell_w, cell_h = width // columns, height // rows
+    side = int(min(cell_w, cell_h) * 0.8)
+    scale = side / max(face.shape[:2])
+    resized = cv2.resize(face, (max(1, int(face.shape[1] * scale)), max(1, int(face.shape[0] * scale))),
+                         interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC)
+    for index in range(face_count):
+        row, column = divmod(index, columns)
+        x = column * cell_w + (cell_w - resized.shape[1]) // 2
+        y = row * cell_h + (cell_h - resized.shape[0]) // 2
+        frame[y:y + resized.shape[0], x:x + resized.shape[1]] = resized
+    return frame
+
+
+def resized_asset(asset, long_edge):
+    """A copy of an asset scaled so its long edge is long_edge pixels"""
+    scale = long_edge / max(asset.width, asset.height)
+    size = (max(1, round(asset.width * scale)), max(1, round(asset.height * scale)))
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    # Resized from the premultiplied pixels, which bundled assets have without straight RGBA
+    resized = cv2.resize(asset.premultiplied, size, interpolation=interpolation)
+    return Asset(asset.kind, f"{asset.name}@{long_edge}", pyramid=build_pyramid(resized))
+
+
+def bench_stages(args):
+    """Time each pipeline stage over a matrix of frame sizes, face counts, asset sizes and encoders"""
+    assets = pipeline.asset_registry.load()
+    if not assets.characters or not assets.lovers:
+        raise SystemExit("The stage benchmark needs at least one character and one lover image")
+    face = sample_face(args.face_image)
+    rng = np.random.default_rng(args.seed)
+    results = []
+
+    for width, height in map(parse_size, args.sizes):
+        for face_count in args.faces:
+            frame = synthetic_frame(width, height, face, face_count, rng)
+            ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
+            contents = encoded.tobytes()
+            info = pipeline.inspect_upload(contents)
+            image = pipeline.decode_image(contents, info)
+            landmarks, detection = pipeline.detection_strategy.detect(image)
+            row = {
+                "stage_group": "analyze",
+                "size": f"{width}x{height}",
+                "faces": face_count,
+                "upload_bytes": len(contents),
+                "fallback": detection["fallback"],
+                "probe": summarize(time_call(lambda: pipeline.inspect_upload(contents), args.repeat)),
+                "decode": summarize(time_call(lambda: pipeline.decode_image(contents, info), args.repeat)),
+                "get_face_landmarks": summarize(time_call(lambda: get_face_landmarks(image), args.repeat)),
+                "detect": summarize(time_call(lambda: pipeline.detection_strategy.detect(image), args.repeat)),
+            }
+            results.append(row)
+            print(f"{row['size']:>9} faces {face_count}: decode {row['decode']['p50_ms']:8.2f} ms, "
+                  f"get_face_landmarks {row['get_face_landmarks']['p50_ms']:8.2f} ms, "
+                  f"detect {row['detect']['p50_ms']:8.2f} ms, fallback={row['fallback']}")
+
+        # Compositing and encoding do not depend on how many faces were in the upload
+        frame = synthetic_frame(width, height, face, 1, rng)
+        landmarks, _ = pipeline.detection_strategy.detect(frame)
+        for long_edge in args.asset_sizes:
+            character = resized_asset(assets.characters[0], long_edge)
+            lover = resized_asset(assets.lovers[0], long_edge)
+
+            def cold_overlay():
+                pipeline.sprite_cache.clear()
+                pipeline.align_and_overlay_face(frame, character, landmarks)
+
+            def cold_lover():
+                pipeline.sprite_cache.clear()
+                pipeline.add_lover_image(frame, lover)
+
+            row = {
+                "stage_group": "composite",
+                "size": f"{width}x{height}",
+                "asset_long_edge": long_edge,
+                "character_overlay_cold": summarize(time_call(cold_overlay, args.repeat)),
+                "character_overlay_warm": summarize(time_call(
+                    lambda: pipeline.align_and_overlay_face(frame, character, landmarks), args.repeat)),
+                "lover_overlay_cold": summarize(time_call(cold_lover, args.repeat)),
+                "lover_overlay_warm": summarize(time_call(
+                    lambda: pipeline.add_lover_image(frame, lover), args.repeat)),
+            }
+            results.append(row)
+            print(f"{row['size']:>9} assets {long_edge:4d}px: "
+                  f"character cold {row['character_overlay_cold']['p50_ms']:7.2f} / "
+                  f"warm {row['character_overlay_warm']['p50_ms']:7.2f} ms, "
+                  f"lover cold {row['lover_overlay_cold']['p50_ms']:7.2f} / "
+                  f"warm {row['lover_overlay_warm']['p50_ms']:7.2f} ms")
+
+        composite = pipeline.add_lover_image(
+            pipeline.align_and_overlay_face(frame, assets.characters[0], landmarks), assets.lovers[0], copy=False)
+        for format in args.formats:
+            for preset in args.presets:
+                options = EncodeOptions(format=format, preset=preset)
+                buffer, _ = encode_image(composite, options)
+                row = {
+                    "stage_group": "encode",
+                    "size": f"{width}x{height}",
+                    "format": format,
+                    "preset": preset,
+                    "output_bytes": len(buffer),
+                    "encode": summarize(time_call(lambda: encode_image(composite, options), args.repeat)),
+                }
+                results.append(row)
+                print(f"{row['size']:>9} encode {format}/{preset}: {row['encode']['p50_ms']:8.2f} ms, "
+                      f"{len(buffer)} bytes")
+    return results
+
+
+def environment():
+    """Where the numbers came from, so result files can be compared"""
+    return {
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "cv_threads": cv2.getNumThreads(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Magadheera image pipeline")
+    parser.add_argument("--repeat", type=int, default=30, help="Runs per measurement")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    subparsers = parser.add_subparsers(dest="bench", required=True)
+
+    overlay = subparsers.add_parser("overlay", help="Cached vs single-warp character placement")
+    overlay.add_argument("--width", type=int, default=1920)
+    overlay.add_argument("--height", type=int, default=1080)
+    overlay.add_argument("--face-sizes", type=int, nargs="+", default=[120, 300, 600])
+    overlay.add_argument("--angles", type=float, nargs="+", default=[0.0, 7.0, 20.0])
+    overlay.set_defaults(func=bench_overlay)
+
+    detection = subparsers.add_parser("detection", help="Downscaled face detection speed vs recall")
+    detection.add_argument("--images", nargs="+", default=SAMPLE_IMAGES)
+    detection.add_argument("--sizes", type=int, nargs="+", default=[1280, 2560, 4000],
+                           help="Long edges the sample images are resized to")
+    detection.add_argument("--caps", type=int, nargs="+", default=[0, 480, 640, 960, 1280],
+                           help="DETECT_MAX_EDGE values to compare, 0 is full resolution")
+    detection.set_defaults(func=bench_detection)
+
+    stages = subparsers.add_parser("stages", help="Per-stage timings over sizes, face counts, assets and encoders")
+    stages.add_argument("--sizes", nargs="+",
+                        default=["640x480", "1280x720", "1920x1080", "2560x1440", "4000x3000", "4000x4000"],
+                        help="Frame sizes as WIDTHxHEIGHT")
+    stages.add_argument("--faces", type=int, nargs="+", default=[0, 1, 3],
+                        help="Faces pasted into each frame, 0 exercises the fallback path")
+    stages.add_argument("--asset-sizes", type=int, nargs="+", default=[300, 600, 1200],
+                        help="Long edges the character and lover are resized to")
+    stages.add_argument("--formats", nargs="+", default=["jpeg", "webp", "png"])
+    stages.add_argument("--presets", nargs="+", default=["quality", "fast"])
+    stages.add_argument("--face-image", default="test_face.jpg", help="Sample photo the faces are cut from")
+    stages.add_argument("--seed", type=int, default=0, help="Seed for the synthetic background")
+    stages.set_defaults(func=bench_stages)
+
+    args = parser.parse_args()
+    results = args.func(args)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "bench": args.bench,
+                "repeat": args.repeat,
+                "environment": environment(),
+                "results": results,
+            }, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
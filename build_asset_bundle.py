@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Pack the character and lover images into a memory-mappable asset bundle
+The backend maps the bundle read-only, so every worker shares one copy of the
+pixels in the page cache and starts without decoding any PNGs
+"""
+
+import argparse
+import os
+
+import numpy as np
+from PIL import Image
+
+import config
+from assets import Asset, AssetSet, fit_to_canvas, pack_bundle, scan_folder
+
+# Same canvas sizes the image manager saves assets at
+TARGET_SIZES = {
+    "character": (300, 400),
+    "lover": (200, 300),
+}
+
+
+def load_for_bundle(kind, folder, normalize):
+    """Decode every PNG in a folder, optionally fitting it to the standard canvas"""
+    assets = []
+    for path in sorted(scan_folder(folder)):
+        try:
+            with Image.open(path) as img:
+                img = img.convert("RGBA")
+                if normalize:
+                    img = fit_to_canvas(img, TARGET_SIZES[kind])
+                rgba = np.asarray(img)
+        except Exception as e:
+            print(f"⚠️  Skipping {path}: {e}")
+            continue
+        name = os.path.splitext(os.path.basename(path))[0]
+        assets.append(Asset(kind, name, rgba))
+    return assets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the Magadheera asset bundle")
+    parser.add_argument("--characters", default=config.CHARACTERS_DIR, help="Character images folder")
+    parser.add_argument("--lovers", default=config.LOVERS_DIR, help="Lover images folder")
+    parser.add_argument("--output", default=config.ASSET_BUNDLE or "assets.bundle", help="Bundle file to write")
+    parser.add_argument("--normalize", action="store_true",
+                        help="Fit images to the standard 300x400 / 200x300 canvases")
+    args = parser.parse_args()
+
+    asset_set = AssetSet(
+        load_for_bundle("character", args.characters, args.normalize),
+        load_for_bundle("lover", args.lovers, args.normalize),
+    )
+    if not asset_set.characters:
+        print("❌ No character images found, bundle not written")
+        return
+
+    count, size = pack_bundle(asset_set, args.output)
+    print(f"📦 Packed {count} images into {args.output} ({size // 1024} KB)")
+    print(f"   Characters: {len(asset_set.characters)}, Lovers: {len(asset_set.lovers)}")
+    print("   A running backend picks up the new bundle automatically")
+
+
+if __name__ == "__main__":
+    main()
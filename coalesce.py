@@ -0,0 +1,41 @@
+"""
+Single-flight coalescing of identical pipeline runs
+Concurrent requests for the same result key share one computation instead
+of each running the full pipeline
+"""
+
+import asyncio
+
+
+class SingleFlight:
+    """Runs at most one computation per key at a time; later callers join it"""
+
+    def __init__(self):
+        self._tasks = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def run(self, key, compute):
+        """Await compute() for key, or the run already in progress for it
+
+        Returns (result, joined) where joined is True when another request
+        did the work. The computation runs as its own task, so a caller that
+        disconnects does not cancel it for the others.
+        """
+        task = self._tasks.get(key)
+        joined = task is not None
+        if joined:
+            self.followers += 1
+        else:
+            self.leaders += 1
+            task = asyncio.ensure_future(compute())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        return await asyncio.shield(task), joined
+
+    def stats(self):
+        return {
+            "in_flight": len(self._tasks),
+            "leaders": self.leaders,
+            "followers": self.followers,
+        }
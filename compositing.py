@@ -0,0 +1,99 @@
+"""
+Premultiplied-alpha compositing on BGR uint8 frames
+Sprites are BGRA arrays whose colour channels are already multiplied by
+alpha, so blending is one multiply-add over the overlay's region only
+"""
+
+import cv2
+import numpy as np
+
+
+def premultiply(rgba):
+    """Convert a straight RGBA array into a premultiplied BGRA array"""
+    bgra = cv2.cvtColor(np.ascontiguousarray(rgba), cv2.COLOR_RGBA2BGRA)
+    alpha = bgra[:, :, 3:4].astype(np.uint16)
+    bgra[:, :, :3] = (bgra[:, :, :3] * alpha + 127) // 255
+    return bgra
+
+
+def _div255(values):
+    """Exact rounded division by 255 for uint16 products"""
+    values = values + 128
+    return (values + (values >> 8)) >> 8
+
+
+def blend_premultiplied(frame, sprite, x, y):
+    """Blend a premultiplied BGRA sprite onto a BGR frame in place at (x, y)
+
+    Parts of the sprite that fall outside the frame are clipped.
+    """
+    frame_h, frame_w = frame.shape[:2]
+    sprite_h, sprite_w = sprite.shape[:2]
+
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + sprite_w, frame_w), min(y + sprite_h, frame_h)
+    if x0 >= x1 or y0 >= y1:
+        return frame
+
+    src = sprite[y0 - y:y1 - y, x0 - x:x1 - x]
+    roi = frame[y0:y1, x0:x1]
+
+    inverse = 255 - src[:, :, 3:4].astype(np.uint16)
+    blended = _div255(roi.astype(np.uint16) * inverse) + src[:, :, :3]
+    # Resampling can push colour slightly above alpha, saturate instead of wrapping
+    np.minimum(blended, 255, out=blended)
+    roi[:] = blended
+    return frame
+
+
+def rotated_size(width, height, angle_degrees):
+    """Size of the bounding box of a width x height rectangle after rotation"""
+    theta = np.radians(angle_degrees)
+    cos, sin = abs(np.cos(theta)), abs(np.sin(theta))
+    return int(np.ceil(height * sin + width * cos)), int(np.ceil(height * cos + width * sin))
+
+
+def rotate_expanded(sprite, angle_degrees, interpolation=cv2.INTER_LINEAR):
+    """Rotate a sprite counter-clockwise onto a canvas large enough to hold it"""
+    height, width = sprite.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle_degrees, 1.0)
+    new_width, new_height = rotated_size(width, height, angle_degrees)
+    matrix[0, 2] += new_width / 2 - width / 2
+    matrix[1, 2] += new_height / 2 - height / 2
+    return cv2.warpAffine(
+        sprite, matrix, (new_width, new_height),
+        flags=interpolation, borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0, 0)
+    )
+
+
+def warp_blend(frame, bgra, scale, angle_degrees, top_left, size):
+    """Scale, rotate and blend a premultiplied BGRA image in one warpAffine pass
+
+    The image is rotated clockwise by angle_degrees about its centre and
+    scaled by scale, then placed so its rotated bounding box of the given
+    size starts at top_left. Only the part of that box inside the frame is
+    rendered, straight into an ROI-sized buffer with alpha in the same pass.
+    """
+    frame_h, frame_w = frame.shape[:2]
+    box_w, box_h = size
+    x0, y0 = max(top_left[0], 0), max(top_left[1], 0)
+    x1, y1 = min(top_left[0] + box_w, frame_w), min(top_left[1] + box_h, frame_h)
+    if x0 >= x1 or y0 >= y1:
+        return frame
+
+    # Similarity transform mapping source pixels to ROI coordinates
+    height, width = bgra.shape[:2]
+    theta = np.radians(angle_degrees)
+    a, b = scale * np.cos(theta), scale * np.sin(theta)
+    center_x = top_left[0] + box_w / 2 - x0
+    center_y = top_left[1] + box_h / 2 - y0
+    matrix = np.array([
+        [a, -b, center_x - (a * width / 2 - b * height / 2)],
+        [b, a, center_y - (b * width / 2 + a * height / 2)],
+    ])
+
+    warped = cv2.warpAffine(
+        bgra, matrix, (x1 - x0, y1 - y0),
+        flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0, 0)
+    )
+    return blend_premultiplied(frame, warped, x0, y0)
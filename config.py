@@ -0,0 +1,99 @@
+"""
+Runtime configuration for the Magadheera backend
+Every setting can be overridden with a MAGADHEERA_<NAME> environment variable
+"""
+
+import os
+
+
+def _env(name, default, cast=str):
+    """Read MAGADHEERA_<name> from the environment, falling back to default"""
+    value = os.environ.get(f"MAGADHEERA_{name}")
+    if value is None or value == "":
+        return default
+    if cast is bool:
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return cast(value)
+
+
+# Largest accepted upload, and accepted image dimensions
+MAX_UPLOAD_MB = _env("MAX_UPLOAD_MB", 10, int)
+MIN_IMAGE_DIM = _env("MIN_IMAGE_DIM", 50, int)
+MAX_IMAGE_DIM = _env("MAX_IMAGE_DIM", 4000, int)
+MAX_IMAGE_PIXELS = _env("MAX_IMAGE_PIXELS", 4000 * 4000, int)
+# Long edge the pipeline works at; larger uploads are decoded reduced and downscaled (0 = full size)
+MAX_WORKING_EDGE = _env("MAX_WORKING_EDGE", 0, int)
+
+# Asset folders and hot reload
+CHARACTERS_DIR = _env("CHARACTERS_DIR", "characters")
+LOVERS_DIR = _env("LOVERS_DIR", "lovers")
+# MGDBNDL2 bundle of premultiplied BGRA pyramid levels built by build_asset_bundle.py,
+# memory-mapped instead of reading the folders when present
+ASSET_BUNDLE = _env("ASSET_BUNDLE", "assets.bundle")
+ASSET_POLL_INTERVAL = _env("ASSET_POLL_INTERVAL", 2.0, float)  # seconds, 0 disables
+
+# Cache of resized and rotated character/lover sprites
+SPRITE_CACHE_MB = _env("SPRITE_CACHE_MB", 64, int)
+SPRITE_SCALE_STEP = _env("SPRITE_SCALE_STEP", 0.02, float)  # relative scale bucket, 0 disables quantizing
+SPRITE_ANGLE_STEP = _env("SPRITE_ANGLE_STEP", 1.0, float)  # degrees per angle bucket, 0 disables quantizing
+
+# Character placement: "cached" resizes and rotates through the sprite cache,
+# "warp" renders straight into the frame with a single affine warp
+OVERLAY_MODE = _env("OVERLAY_MODE", "cached")
+
+# Face detection on large uploads: cap the long edge the face cascade sees (0 = full resolution)
+DETECT_MAX_EDGE = _env("DETECT_MAX_EDGE", 0, int)
+DETECT_REFINE_EYES = _env("DETECT_REFINE_EYES", True, bool)  # search eyes on the full-resolution face
+# Time budget for all detection passes on one image before falling back (0 = unlimited).
+# Off by default: a budget trades recall on large photos for latency, tune it per deployment
+DETECT_BUDGET_MS = _env("DETECT_BUDGET_MS", 0, float)
+
+# Where the decode/detect/composite/encode pipeline runs: "thread" or "process"
+PIPELINE_EXECUTOR = _env("PIPELINE_EXECUTOR", "thread")
+PIPELINE_WORKERS = _env("PIPELINE_WORKERS", 0, int)  # 0 = one per CPU core
+# OpenCV threads per pipeline worker: -1 = 1 per worker process, OpenCV's default in thread mode
+PIPELINE_CV_THREADS = _env("PIPELINE_CV_THREADS", -1, int)
+# Process mode only: recycle a worker after this many jobs to cap leaks (0 = never)
+PIPELINE_MAX_TASKS_PER_CHILD = _env("PIPELINE_MAX_TASKS_PER_CHILD", 0, int)
+PIPELINE_START_METHOD = _env("PIPELINE_START_METHOD", "")  # fork, spawn or forkserver
+
+# Admission control in front of the pipeline
+ADMISSION_MAX_IN_FLIGHT = _env("ADMISSION_MAX_IN_FLIGHT", 0, int)  # 0 = one per pipeline worker
+ADMISSION_MAX_QUEUE = _env("ADMISSION_MAX_QUEUE", 16, int)
+ADMISSION_QUEUE_TIMEOUT = _env("ADMISSION_QUEUE_TIMEOUT", 10.0, float)  # seconds, 0 = wait indefinitely
+ADMISSION_RETRY_AFTER = _env("ADMISSION_RETRY_AFTER", 2, int)  # seconds, sent in Retry-After on 503
+# Upload bodies read at once, each buffering up to MAX_UPLOAD_MB, separately from pipeline slots
+ADMISSION_MAX_UPLOADS = _env("ADMISSION_MAX_UPLOADS", 16, int)
+
+# Output encoding defaults, overridable per request with ?format= and ?preset=
+ENCODE_FORMAT = _env("ENCODE_FORMAT", "jpeg")  # used when Accept does not prefer another format
+ENCODE_PRESET = _env("ENCODE_PRESET", "quality")  # quality, balanced, fast or mobile
+
+# Character and lover choice when the request has no ?seed=: "random" picks anew on
+# every upload, so re-uploading a photo reveals another past life; "content" derives
+# it from the upload's hash so identical uploads get identical (cacheable) results
+SELECTION_MODE = _env("SELECTION_MODE", "random")
+
+# Encoded results keyed by upload hash, chosen assets and output options (0 disables)
+RESULT_CACHE_MB = _env("RESULT_CACHE_MB", 128, int)
+RESULT_CACHE_DIR = _env("RESULT_CACHE_DIR", "")  # optional on-disk tier, empty = memory only
+RESULT_CACHE_DISK_MB = _env("RESULT_CACHE_DISK_MB", 1024, int)
+
+# Reroll sessions keep an upload (and, with the thread executor, its decoded frame
+# and landmarks) for this long after last use
+SESSION_TTL = _env("SESSION_TTL", 600.0, float)  # seconds, 0 disables sessions
+SESSION_CACHE_MB = _env("SESSION_CACHE_MB", 256, int)
+
+# Logging: JSON lines written by a background thread from a bounded queue
+LOG_LEVEL = _env("LOG_LEVEL", "INFO")  # DEBUG adds per-stage pipeline lines
+LOG_SAMPLE_RATE = _env("LOG_SAMPLE_RATE", 1.0, float)  # share of per-request lines kept
+LOG_QUEUE_SIZE = _env("LOG_QUEUE_SIZE", 10000, int)  # records beyond this are dropped, not waited on
+
+# Admin endpoints need this token in X-Admin-Token; empty disables them
+ADMIN_TOKEN = _env("ADMIN_TOKEN", "")
+
+# Sampling profiler, started from /admin/profile or with SIGUSR2
+PROFILE_DIR = _env("PROFILE_DIR", "profiles")
+PROFILE_SECONDS = _env("PROFILE_SECONDS", 30.0, float)  # default run length
+PROFILE_INTERVAL_MS = _env("PROFILE_INTERVAL_MS", 10.0, float)  # time between stack samples
+PROFILE_FORMAT = _env("PROFILE_FORMAT", "speedscope")  # speedscope or collapsed
@@ -0,0 +1,307 @@
+"""
+Face and eye detection for the Magadheera pipeline
+Haar cascades can run on a downscaled copy of large uploads, with the face
+box mapped back to full resolution and eyes optionally refined there.
+DetectionStrategy escalates through cheaper to costlier passes within a
+per-request time budget, then falls back to centre-estimated landmarks.
+"""
+
+import time
+
+import cv2
+
+import config
+
+# Initialize OpenCV face detection
+face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
+
+
+def detection_scale(width, height, max_edge):
+    """Factor to shrink an image so its long edge fits max_edge, 1.0 if it already does"""
+    long_edge = max(width, height)
+    if not max_edge or long_edge <= max_edge:
+        return 1.0
+    return max_edge / long_edge
+
+
+def prepare_gray(image, max_edge):
+    """Grayscale copy for the face cascade, downscaled to max_edge, and its scale"""
+    height, width = image.shape[:2]
+    scale = detection_scale(width, height, max_edge)
+    if scale < 1.0:
+        image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), scale
+
+
+def detect_faces(gray):
+    """Run the face cascade, retrying with looser parameters if nothing is found"""
+    # Detect faces with more sensitive parameters
+    faces = face_cascade.detectMultiScale(
+        gray,
+        scaleFactor=1.05,      # More sensitive scaling
+        minNeighbors=3,        # Fewer neighbors required
+        minSize=(30, 30),      # Smaller minimum face size
+        flags=cv2.CASCADE_SCALE_IMAGE
+    )
+
+    # If no faces found, try with even more sensitive parameters
+    if len(faces) == 0:
+        faces = face_cascade.detectMultiScale(
+            gray,
+            scaleFactor=1.03,
+            minNeighbors=2,
+            minSize=(20, 20),
+            flags=cv2.CASCADE_SCALE_IMAGE
+        )
+    return faces
+
+
+def detect_eyes(face_roi_gray):
+    """Run the eye cascade on a face region, retrying with looser parameters"""
+    # Detect eyes within the face with multiple attempts
+    eyes = eye_cascade.detectMultiScale(
+        face_roi_gray,
+        scaleFactor=1.05,
+        minNeighbors=3,
+        minSize=(10, 10)
+    )
+
+    # If no eyes found, try more sensitive detection
+    if len(eyes) == 0:
+        eyes = eye_cascade.detectMultiScale(
+            face_roi_gray,
+            scaleFactor=1.03,
+            minNeighbors=2,
+            minSize=(5, 5)
+        )
+    return eyes
+
+
+def to_full_resolution(box, scale, width, height):
+    """Map an (x, y, w, h) box found at scale back to the full image"""
+    if scale == 1.0:
+        return tuple(int(v) for v in box)
+    x, y = int(box[0] / scale), int(box[1] / scale)
+    return x, y, min(int(box[2] / scale), width - x), min(int(box[3] / scale), height - y)
+
+
+def face_eye_roi(image, gray, scale, small_face, face, refine_eyes):
+    """Grayscale face region to search for eyes in, and the scale it is at"""
+    x, y, w, h = face
+    if scale < 1.0 and refine_eyes:
+        return cv2.cvtColor(image[y:y+h, x:x+w], cv2.COLOR_BGR2GRAY), 1.0
+    sx, sy, sw, sh = (int(v) for v in small_face)
+    return gray[sy:sy+sh, sx:sx+sw], scale
+
+
+def build_landmarks(face, eyes):
+    """Landmark dict from a full-resolution face box and eyes relative to it"""
+    x, y, w, h = face
+
+    if len(eyes) < 2:
+        # If we can't detect both eyes, estimate positions based on face proportions
+        left_eye = (x + int(w * 0.3), y + int(h * 0.35))
+        right_eye = (x + int(w * 0.7), y + int(h * 0.35))
+    else:
+        # Sort eyes by x coordinate (left to right)
+        eyes = sorted(eyes, key=lambda e: e[0])
+        left_eye_local = eyes[0]
+        right_eye_local = eyes[-1]
+
+        # Convert to global coordinates and get center points
+        left_eye = (x + left_eye_local[0] + left_eye_local[2]//2,
+                   y + left_eye_local[1] + left_eye_local[3]//2)
+        right_eye = (x + right_eye_local[0] + right_eye_local[2]//2,
+                    y + right_eye_local[1] + right_eye_local[3]//2)
+
+    # Create simplified landmark structure
+    return {
+        'face_rect': (x, y, w, h),
+        'left_eye': left_eye,
+        'right_eye': right_eye,
+        'nose_tip': (x + w//2, y + h//2),
+        'chin': (x + w//2, y + h - h//8)
+    }
+
+
+def fallback_landmarks(width, height):
+    """Estimated face landmarks centred in the image, used when no face is found"""
+    center_x, center_y = width // 2, height // 2
+    face_size = min(width, height) // 4
+
+    return {
+        'face_rect': (center_x - face_size, center_y - face_size, face_size * 2, face_size * 2),
+        'left_eye': (center_x - face_size//2, center_y - face_size//3),
+        'right_eye': (center_x + face_size//2, center_y - face_size//3),
+        'nose_tip': (center_x, center_y),
+        'chin': (center_x, center_y + face_size//2)
+    }
+
+
+def get_face_landmarks(image, max_edge=None, refine_eyes=None):
+    """Extract face landmarks using OpenCV
+
+    With max_edge set (default DETECT_MAX_EDGE), faces are searched on a copy
+    whose long edge is at most max_edge pixels. Eyes are then searched on the
+    full-resolution face region when refine_eyes is on (DETECT_REFINE_EYES),
+    or on the downscaled one otherwise.
+    """
+    max_edge = config.DETECT_MAX_EDGE if max_edge is None else max_edge
+    refine_eyes = config.DETECT_REFINE_EYES if refine_eyes is None else refine_eyes
+
+    height, width = image.shape[:2]
+    gray, scale = prepare_gray(image, max_edge)
+
+    faces = detect_faces(gray)
+    if len(faces) == 0:
+        return None
+
+    # Get the largest face
+    small_face = max(faces, key=lambda x: x[2] * x[3])
+    face = to_full_resolution(small_face, scale, width, height)
+
+    # Extract face region for eye detection
+    roi, roi_scale = face_eye_roi(image, gray, scale, small_face, face, refine_eyes)
+    eyes = [tuple(int(v / roi_scale) for v in eye) for eye in detect_eyes(roi)]
+
+    return build_landmarks(face, eyes)
+
+
+# Face passes in escalation order: (name, equalize, downscale, scaleFactor, minNeighbors, minSize, cost)
+# cost is the expected duration relative to the base pass on the same image, used
+# to order the passes and skip those that cannot finish inside the remaining budget
+# base and sensitive are the original two-step search, so without a budget
+# detection finds every face the original did
+FACE_PASSES = [
+    ("base", False, 1.0, 1.05, 3, 30, 1.0),
+    ("sensitive", False, 1.0, 1.03, 2, 20, 1.7),
+    ("equalized", True, 1.0, 1.05, 3, 30, 1.0),
+    ("coarse", True, 0.5, 1.1, 2, 20, 0.15),
+    ("fine", True, 1.0, 1.03, 2, 20, 1.7),
+]
+
+# Typical cost of the base pass; fixed for ordering passes so the order only
+# depends on the image size, and the starting estimate when skipping them
+BASE_MS_PER_MEGAPIXEL = 150.0
+
+# Eye passes in escalation order: (name, scaleFactor, minNeighbors, minSize)
+EYE_PASSES = [
+    ("base", 1.05, 3, 10),
+    ("fine", 1.03, 2, 5),
+]
+
+
+class DetectionStrategy:
+    """Escalating face and eye detection bounded by a per-request time budget
+
+    Passes run in escalation order and stop at the first hit.
+    Pass durations are predicted from the image's pixel count, and on
+    images where a full-resolution pass would take most of the budget the
+    cheapest passes run first. Once the budget is spent, or the next pass
+    is not expected to fit in what is left of it, detection gives up and
+    returns fallback landmarks.
+    """
+
+    def __init__(self, budget_ms=None, max_edge=None, refine_eyes=None):
+        self.budget_ms = config.DETECT_BUDGET_MS if budget_ms is None else budget_ms
+        self.max_edge = config.DETECT_MAX_EDGE if max_edge is None else max_edge
+        self.refine_eyes = config.DETECT_REFINE_EYES if refine_eyes is None else refine_eyes
+        # Moving estimate of the base pass's ms per megapixel on this machine,
+        # refined from every pass that runs
+        self.ms_per_megapixel = BASE_MS_PER_MEGAPIXEL
+
+    def _face_passes(self, megapixels):
+        """Face passes in the order to try them for an image of this size"""
+        if self.budget_ms and BASE_MS_PER_MEGAPIXEL * megapixels > self.budget_ms / 2:
+            # A full-resolution pass would leave no room to escalate, start coarse
+            return sorted(FACE_PASSES, key=lambda face_pass: face_pass[-1])
+        return FACE_PASSES
+
+    def _fits(self, started, expected_ms):
+        if not self.budget_ms:
+            return True
+        elapsed = (time.perf_counter() - started) * 1000
+        return elapsed + expected_ms <= self.budget_ms
+
+    def _find_face(self, gray, started, info):
+        equalized = None
+        megapixels = gray.size / 1e6
+        passes = self._face_passes(megapixels)
+        for name, equalize, downscale, scale_factor, min_neighbors, min_size, cost in passes:
+            expected_ms = self.ms_per_megapixel * megapixels * cost
+            # The first pass always runs, so every image gets at least one try
+            if name != passes[0][0] and not self._fits(started, expected_ms):
+                info["budget_cut"] = True
+                break
+            pass_started = time.perf_counter()
+
+            source = gray
+            if equalize:
+                if equalized is None:
+                    equalized = cv2.equalizeHist(gray)
+                source = equalized
+            if downscale != 1.0:
+                source = cv2.resize(source, None, fx=downscale, fy=downscale, interpolation=cv2.INTER_AREA)
+
+            faces = face_cascade.detectMultiScale(
+                source,
+                scaleFactor=scale_factor,
+                minNeighbors=min_neighbors,
+                minSize=(min_size, min_size),
+                flags=cv2.CASCADE_SCALE_IMAGE
+            )
+            pass_ms = (time.perf_counter() - pass_started) * 1000
+            if megapixels:
+                self.ms_per_megapixel += 0.2 * (pass_ms / (megapixels * cost) - self.ms_per_megapixel)
+            if len(faces):
+                face = max(faces, key=lambda x: x[2] * x[3])
+                return tuple(int(v / downscale) for v in face), name
+        return None, None
+
+    def _find_eyes(self, roi, started, info):
+        for name, scale_factor, min_neighbors, min_size in EYE_PASSES:
+            if name != "base" and not self._fits(started, 0):
+                info["budget_cut"] = True
+                break
+            eyes = eye_cascade.detectMultiScale(
+                roi,
+                scaleFactor=scale_factor,
+                minNeighbors=min_neighbors,
+                minSize=(min_size, min_size)
+            )
+            if len(eyes):
+                return eyes
+        return []
+
+    def detect(self, image):
+        """Return (face_landmarks, info) for an image, never None
+
+        info records whether fallback landmarks were used, which face pass
+        succeeded, whether the budget stopped any pass from running and how
+        long face and eye detection took. A budget cut depends on timing, so
+        the same image may be detected differently on another run.
+        """
+        started = time.perf_counter()
+        height, width = image.shape[:2]
+        gray, scale = prepare_gray(image, self.max_edge)
+
+        info = {"budget_cut": False}
+        small_face, face_pass = self._find_face(gray, started, info)
+        face_done = time.perf_counter()
+        info.update({
+            "fallback": small_face is None,
+            "face_pass": face_pass,
+            "face_ms": (face_done - started) * 1000,
+            "eye_ms": 0.0,
+        })
+        if small_face is None:
+            return fallback_landmarks(width, height), info
+
+        face = to_full_resolution(small_face, scale, width, height)
+        roi, roi_scale = face_eye_roi(image, gray, scale, small_face, face, self.refine_eyes)
+        eyes = [tuple(int(v / roi_scale) for v in eye) for eye in self._find_eyes(roi, started, info)]
+        info["eye_ms"] = (time.perf_counter() - face_done) * 1000
+
+        return build_landmarks(face, eyes), info
@@ -0,0 +1,141 @@
+"""
+Output encoding for the Magadheera pipeline
+Picks JPEG, WebP or PNG from the request, applies a named quality/speed
+preset and optionally downscales before encoding
+"""
+
+import time
+
+import cv2
+
+import config
+
+# (file extension, media type) for each output format
+FORMATS = {
+    "jpeg": (".jpg", "image/jpeg"),
+    "webp": (".webp", "image/webp"),
+    "png": (".png", "image/png"),
+}
+
+# JPEG chroma subsampling modes, when this OpenCV build supports choosing one
+SUBSAMPLING = {
+    "444": getattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR_444", None),
+    "422": getattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR_422", None),
+    "420": getattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR_420", None),
+}
+
+# quality applies to JPEG and WebP, png_compression to PNG
+PRESETS = {
+    # The original output: high quality with a second Huffman pass
+    "quality": {"quality": 95, "optimize": True, "progressive": False, "subsampling": None,
+                "png_compression": 6, "max_dim": 0},
+    "balanced": {"quality": 85, "optimize": False, "progressive": False, "subsampling": "420",
+                 "png_compression": 3, "max_dim": 0},
+    "fast": {"quality": 75, "optimize": False, "progressive": False, "subsampling": "420",
+             "png_compression": 1, "max_dim": 0},
+    # Small progressive files for phones on slow links
+    "mobile": {"quality": 75, "optimize": False, "progressive": True, "subsampling": "420",
+               "png_compression": 3, "max_dim": 1280},
+}
+
+
+class EncodeOptions:
+    """Resolved output settings for one request"""
+
+    def __init__(self, format="jpeg", preset=None, max_dim=None, progressive=None, subsampling=None):
+        preset = preset or config.ENCODE_PRESET
+        if format not in FORMATS:
+            raise ValueError(f"Unsupported format {format!r}, expected one of {', '.join(FORMATS)}")
+        if preset not in PRESETS:
+            raise ValueError(f"Unknown preset {preset!r}, expected one of {', '.join(PRESETS)}")
+        if subsampling is not None and subsampling not in SUBSAMPLING:
+            raise ValueError(f"Unsupported subsampling {subsampling!r}, expected one of {', '.join(SUBSAMPLING)}")
+        if max_dim is not None and max_dim < 0:
+            raise ValueError("max_dim must not be negative")
+
+        settings = PRESETS[preset]
+        self.format = format
+        self.preset = preset
+        self.quality = settings["quality"]
+        self.optimize = settings["optimize"]
+        self.png_compression = settings["png_compression"]
+        self.progressive = settings["progressive"] if progressive is None else progressive
+        self.subsampling = settings["subsampling"] if subsampling is None else subsampling
+        self.max_dim = settings["max_dim"] if max_dim is None else max_dim
+
+    @property
+    def media_type(self):
+        return FORMATS[self.format][1]
+
+    @property
+    def extension(self):
+        return FORMATS[self.format][0]
+
+    def key(self):
+        """Tuple identifying the output these options produce"""
+        return (self.format, self.quality, self.optimize, self.progressive,
+                self.subsampling, self.png_compression, self.max_dim)
+
+    def params(self):
+        """cv2.imencode parameters for these options"""
+        if self.format == "jpeg":
+            params = [cv2.IMWRITE_JPEG_QUALITY, self.quality,
+                      cv2.IMWRITE_JPEG_OPTIMIZE, int(self.optimize),
+                      cv2.IMWRITE_JPEG_PROGRESSIVE, int(self.progressive)]
+            factor = SUBSAMPLING.get(self.subsampling)
+            if factor is not None:
+                params += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR, factor]
+            return params
+        if self.format == "webp":
+            return [cv2.IMWRITE_WEBP_QUALITY, self.quality]
+        return [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression]
+
+
+def _parse_accept(accept):
+    """Media ranges from an Accept header, best first, ignoring q=0"""
+    ranges = []
+    for position, part in enumerate(accept.split(",")):
+        fields = part.strip().split(";")
+        media = fields[0].strip().lower()
+        q = 1.0
+        for param in fields[1:]:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media and q > 0:
+            ranges.append((-q, position, media))
+    return [media for _, _, media in sorted(ranges)]
+
+
+def negotiate_format(accept=None, requested=None):
+    """Pick the output format from an explicit request or the Accept header"""
+    if requested:
+        requested = requested.lower()
+        return "jpeg" if requested == "jpg" else requested
+    default = config.ENCODE_FORMAT
+    for media in _parse_accept(accept or ""):
+        for name, (_, media_type) in FORMATS.items():
+            if media == media_type:
+                return name
+        if media in ("image/*", "*/*"):
+            return default
+    return default
+
+
+def encode_image(image, options):
+    """Encode an image, returning (buffer, encode time in ms)"""
+    started = time.perf_counter()
+
+    height, width = image.shape[:2]
+    if options.max_dim and max(width, height) > options.max_dim:
+        scale = options.max_dim / max(width, height)
+        image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+
+    success, buffer = cv2.imencode(options.extension, image, options.params())
+    if not success:
+        raise RuntimeError(f"Failed to encode result image as {options.format}")
+    return buffer, (time.perf_counter() - started) * 1000
@@ -0,0 +1,87 @@
+"""
+Executors that run the image pipeline off the asyncio event loop
+A thread pool suits OpenCV calls that release the GIL; a process pool
+spreads the pure-Python parts across cores as well
+"""
+
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+
+import config
+from pipeline import init_worker
+
+
+class WorkerPool(ProcessPoolExecutor):
+    """Process pool whose workers report their pid once init_worker has finished"""
+
+    def __init__(self, max_workers, mp_context, cv_threads, **kwargs):
+        self._ready_queue = mp_context.SimpleQueue()
+        self._ready = set()
+        super().__init__(
+            max_workers=max_workers,
+            mp_context=mp_context,
+            initializer=init_worker,
+            initargs=(cv_threads, self._ready_queue),
+            **kwargs
+        )
+
+    def ready_pids(self, live_pids):
+        """The live workers among live_pids that have finished initialising"""
+        while not self._ready_queue.empty():
+            self._ready.add(self._ready_queue.get())
+        # Forget recycled or crashed workers, so a reused pid is not taken as ready
+        self._ready &= set(live_pids)
+        return sorted(self._ready)
+
+
+def create_executor(kind=None, workers=None):
+    """Create the configured pipeline executor ("thread" or "process")"""
+    kind = kind or config.PIPELINE_EXECUTOR
+    workers = workers or config.PIPELINE_WORKERS or os.cpu_count() or 1
+    cv_threads = config.PIPELINE_CV_THREADS
+
+    if kind == "process":
+        # One OpenCV thread per worker unless configured, so workers x threads never oversubscribes
+        max_tasks = config.PIPELINE_MAX_TASKS_PER_CHILD or None
+        # Recycling workers is not supported with fork, so default to spawn then
+        start_method = config.PIPELINE_START_METHOD or ("spawn" if max_tasks else None)
+        # max_tasks_per_child only exists from Python 3.11, so pass it only when set
+        recycling = {"max_tasks_per_child": max_tasks} if max_tasks else {}
+        return WorkerPool(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context(start_method),
+            cv_threads=1 if cv_threads < 0 else cv_threads,
+            **recycling
+        )
+    if kind == "thread":
+        if cv_threads >= 0:
+            cv2.setNumThreads(cv_threads)
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pipeline")
+    raise ValueError(f"Unknown pipeline executor {kind!r}, expected 'thread' or 'process'")
+
+
+async def run_in_executor(executor, func, *args, **kwargs):
+    """Await func(*args, **kwargs) running on executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+def shares_memory(executor):
+    """Whether results come back as the objects themselves rather than pickled copies"""
+    return not isinstance(executor, ProcessPoolExecutor)
+
+
+def worker_pids(executor):
+    """Process ids of a process pool's live, initialised workers; empty for a thread pool
+
+    Workers still starting up are left out: until init_worker installs their
+    handlers, signals such as SIGUSR2 would kill them.
+    """
+    processes = getattr(executor, "_processes", None) or {}
+    live = [pid for pid, process in list(processes.items()) if process.is_alive()]
+    return executor.ready_pids(live) if isinstance(executor, WorkerPool) else []
@@ -11,6 +11,9 @@ from tkinter import filedialog, messagebox, ttk
 from PIL import Image, ImageTk
 import json
 
+import config
+from assets import fit_to_canvas
+
 class MagadheeraImageManager:
     def __init__(self):
         self.root = tk.Tk()
@@ -214,13 +217,13 @@ HOW TO USE:
 AFTER ADDING IMAGES:
 
 1. Close this manager
-2. Restart your backend server: python app.py
+2. The running backend picks up new images within a few seconds
 3. Test the app at: http://localhost:3000
 4. Your custom images will now be used for face replacement!
 
 TROUBLESHOOTING:
 
-- If images don't appear: Check that backend server is restarted
+- If images don't appear: Check that the backend server is running
 - If face replacement doesn't work well: Try images with clearer faces
 - If app crashes: Check that image files are not corrupted
 - For best results: Use PNG images with transparent backgrounds
@@ -230,7 +233,7 @@ EXAMPLE WORKFLOW:
 1. Save warrior/character images from internet or your collection
 2. Use this manager to add them to the "Characters" section
 3. Add princess/lover images to the "Lovers" section
-4. Restart backend server
+4. Wait a few seconds for the backend to reload them
 5. Test the app - your face will be replaced with random characters!
 
 The app will randomly select from your custom images each time someone uses it.
@@ -266,7 +269,7 @@ The app will randomly select from your custom images each time someone uses it.
             if success_count > 0:
                 messagebox.showinfo("Success", 
                     f"Added {success_count} character images!\n\n"
-                    "Remember to restart your backend server to use the new images.")
+                    + self.pickup_message())
         
     def add_lover_images(self):
         """Add lover images"""
@@ -292,8 +295,15 @@ The app will randomly select from your custom images each time someone uses it.
             if success_count > 0:
                 messagebox.showinfo("Success", 
                     f"Added {success_count} lover images!\n\n"
-                    "Remember to restart your backend server to use the new images.")
+                    + self.pickup_message())
     
+    def pickup_message(self):
+        """How a running backend will see newly added images"""
+        if config.ASSET_BUNDLE and os.path.exists(config.ASSET_BUNDLE):
+            return (f"The backend serves images from {config.ASSET_BUNDLE}, "
+                    "run build_asset_bundle.py to include them.")
+        return "The running backend will pick them up automatically."
+
     def process_and_save_image(self, input_path, output_dir, target_size):
         """Process and save an image"""
         try:
@@ -309,20 +319,8 @@ The app will randomly select from your custom images each time someone uses it.
             
             # Process image
             with Image.open(input_path) as img:
-                # Convert to RGBA for transparency support
-                if img.mode != 'RGBA':
-                    img = img.convert('RGBA')
-                
-                # Resize maintaining aspect ratio
-                img.thumbnail(target_size, Image.Resampling.LANCZOS)
-                
-                # Create new image with target size and transparent background
-                new_img = Image.new('RGBA', target_size, (0, 0, 0, 0))
-                
-                # Center the resized image
-                x = (target_size[0] - img.width) // 2
-                y = (target_size[1] - img.height) // 2
-                new_img.paste(img, (x, y), img)
+                # Fit onto a transparent canvas of the target size
+                new_img = fit_to_canvas(img, target_size)
                 
                 # Save as PNG
                 new_img.save(output_path, 'PNG')
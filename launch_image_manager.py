@@ -42,7 +42,8 @@ def main():
             print("\n📋 Manual instructions:")
             print("1. Copy your warrior images to: characters/ folder")
             print("2. Copy your princess images to: lovers/ folder")
-            print("3. Restart backend: python app.py")
+            print("3. A running backend picks them up within a few seconds")
+            print("   (if backend/assets.bundle exists, rebuild it: python build_asset_bundle.py)")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,131 @@
+"""
+Structured, non-blocking logging for the Magadheera backend
+Records are queued by the request path and written as JSON lines by a
+background thread, so a slow stdout never stalls a request
+"""
+
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+import config
+
+# LogRecord attributes that are not user-supplied fields
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+_listener_pid = None
+_queue = None
+
+# Loggers uvicorn gives their own synchronous stdout handlers, e.g. one write
+# per request for the access log, unless started with log_config=None
+SERVER_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and any extra fields"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    dropped = 0
+
+    def prepare(self, record):
+        # Keep the record's extra fields for JsonFormatter, but resolve the
+        # message and traceback now, while their arguments are still current
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+def setup_logging(level=None, stream=None):
+    """Route all logging through a bounded queue to a JSON-lines writer thread
+
+    Safe to call again, e.g. in a worker process: the writer thread is
+    (re)started once per process.
+    """
+    global _listener, _listener_pid, _queue
+    if _listener is not None and _listener_pid == os.getpid():
+        return
+    log_queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+
+    # Send the server's own loggers through the queue as well
+    for name in SERVER_LOGGERS:
+        server_logger = logging.getLogger(name)
+        server_logger.handlers.clear()
+        server_logger.propagate = True
+
+    writer = logging.StreamHandler(stream or sys.stdout)
+    writer.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, DroppingQueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.setLevel((level or config.LOG_LEVEL).upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, writer, respect_handler_level=False)
+    _listener.start()
+    _listener_pid = os.getpid()
+    _queue = log_queue
+
+
+def stop_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+    _listener = None
+
+
+def stats():
+    """Records waiting for the writer thread and records dropped on a full queue"""
+    return {
+        "queued": _queue.qsize() if _queue is not None else 0,
+        "max_queue": config.LOG_QUEUE_SIZE,
+        "dropped": DroppingQueueHandler.dropped,
+    }
+
+
+def sampled(logger, level=logging.INFO):
+    """Whether to emit a per-request line, applying LOG_SAMPLE_RATE
+
+    Checked before building the record, so dropped lines cost nothing.
+    """
+    if not logger.isEnabledFor(level):
+        return False
+    rate = config.LOG_SAMPLE_RATE
+    return rate >= 1 or random.random() < rate
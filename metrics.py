@@ -0,0 +1,161 @@
+"""
+Prometheus metrics for the Magadheera backend
+Fixed-bucket histograms and counters cheap enough for the request path,
+plus collectors that turn the caches' and admission controller's stats
+into gauges and counters when /metrics is scraped
+"""
+
+import bisect
+import threading
+
+# Upper bounds in seconds, from sprite cache hits up to detection on huge uploads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PREFIX = "magadheera_"
+
+# Metrics and collector functions rendered by render(), in registration order
+_registry = []
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count, optionally split by label values"""
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}_total{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram, optionally split by label values"""
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last is +Inf), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        names = self.labelnames + ("le",)
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(names, labels + (_format_value(bound),))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class GaugeCollector:
+    """Gauges read from a callback at scrape time
+
+    The callback returns (name, help, value) tuples, where value is a number
+    or a list of ({label: value}, number) pairs.
+    """
+
+    type = "gauge"
+    suffix = ""
+
+    def __init__(self, callback):
+        self.callback = callback
+        _registry.append(self)
+
+    def collect(self):
+        for name, help, value in self.callback():
+            name = PREFIX + name
+            yield f"# HELP {name} {help}"
+            yield f"# TYPE {name} {self.type}"
+            samples = value if isinstance(value, list) else [({}, value)]
+            for labels, number in samples:
+                yield f"{name}{self.suffix}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(number)}"
+
+
+class CounterCollector(GaugeCollector):
+    """Counters kept elsewhere, e.g. in component stats, read at scrape time"""
+
+    type = "counter"
+    suffix = "_total"
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+# Time spent in each pipeline stage, per run rather than per response
+STAGE_SECONDS = Histogram(
+    "stage_seconds",
+    "Time spent in each pipeline stage",
+    labelnames=("stage",)
+)
+
+# End-to-end handler time, split by how the result was produced
+REQUEST_SECONDS = Histogram(
+    "request_seconds",
+    "Time to answer an image request",
+    labelnames=("endpoint", "cache")
+)
+
+PIPELINE_RUNS = Counter("pipeline_runs", "Pipeline runs that produced a new result", labelnames=("kind",))
+FALLBACK_LANDMARKS = Counter("fallback_landmarks", "Pipeline runs that used estimated landmarks, no face found")
+
+
+def observe_stages(timings):
+    """Record a run's per-stage millisecond timings"""
+    for stage, ms in timings.items():
+        STAGE_SECONDS.observe(ms / 1000, stage)
@@ -0,0 +1,395 @@
+"""
+Image processing pipeline for the Magadheera backend
+Decodes an upload, detects the face, composites a character and lover and
+encodes the result. Runs off the event loop, in a thread or worker process.
+"""
+
+import logging
+import math
+import os
+import time
+
+import cv2
+import numpy as np
+
+import config
+from assets import AssetRegistry
+from compositing import blend_premultiplied, rotated_size, warp_blend
+from detection import DetectionStrategy, eye_cascade, face_cascade
+from encoding import EncodeOptions, encode_image
+from logs import setup_logging
+from probe import ProbeError, probe_image
+from profiler import install_signal_handler
+from sprites import SpriteCache
+
+log = logging.getLogger(__name__)
+
+# Decoded character and lover images, loaded once at startup
+asset_registry = AssetRegistry()
+
+# Escalating face detection bounded by DETECT_BUDGET_MS
+detection_strategy = DetectionStrategy()
+
+# Resized and rotated sprites, reused across requests with similar faces
+sprite_cache = SpriteCache()
+
+
+class PipelineError(Exception):
+    """A request the pipeline rejected, carrying the HTTP status to answer with"""
+
+    def __init__(self, status_code, detail):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class PipelineResult:
+    """Encoded output of one pipeline run and what went into it"""
+
+    def __init__(self, buffer, options, using_fallback, character, lover, encode_ms, budget_cut=False):
+        self.buffer = buffer
+        self.media_type = options.media_type
+        self.extension = options.extension
+        self.using_fallback = using_fallback
+        # Detection was cut short by DETECT_BUDGET_MS, so another run may differ
+        self.budget_cut = budget_cut
+        self.character = character
+        self.lover = lover
+        self.encode_ms = encode_ms
+        # Milliseconds per stage, filled in by the stages that ran
+        self.timings = {"encode": encode_ms}
+        # Set by process_upload(keep_frame=True) for reroll sessions
+        self.frame = None
+        self.landmarks = None
+
+
+def get_random_character(assets=None):
+    """Get a random character from the preloaded asset registry"""
+    return (assets or asset_registry.snapshot()).random_character()
+
+
+def get_random_lover(assets=None):
+    """Get a random lover from the preloaded asset registry"""
+    return (assets or asset_registry.snapshot()).random_lover()
+
+
+def calculate_angle(point1, point2):
+    """Calculate angle between two points"""
+    return math.atan2(point2[1] - point1[1], point2[0] - point1[0])
+
+
+def align_and_overlay_face(base_image, character, face_landmarks, copy=True, mode=None):
+    """Align and overlay character face on detected face
+
+    Composites straight into the BGR array; pass copy=False to draw onto
+    base_image itself instead of a copy. mode picks "cached" or "warp"
+    placement and defaults to the configured OVERLAY_MODE.
+    """
+    frame_height, frame_width = base_image.shape[:2]
+
+    # Get face information from landmarks
+    left_eye = face_landmarks['left_eye']
+    right_eye = face_landmarks['right_eye']
+    nose_tip = face_landmarks['nose_tip']
+    chin = face_landmarks['chin']
+    face_rect = face_landmarks['face_rect']
+
+    # Calculate face dimensions and angle
+    eye_distance = math.sqrt((right_eye[0] - left_eye[0])**2 + (right_eye[1] - left_eye[1])**2)
+    face_width = face_rect[2]
+    face_height = face_rect[3]
+
+    # Calculate rotation angle
+    angle = calculate_angle(left_eye, right_eye)
+    angle_degrees = math.degrees(angle)
+
+    # Improved scaling logic for better face replacement
+    # Scale based on face height for better proportions
+    scale_factor = max(face_width / character.width, face_height / character.height) * 1.3
+    new_width = int(character.width * scale_factor)
+
+    # Ensure minimum size for visibility
+    min_size = 150
+    if new_width < min_size:
+        scale_factor = min_size / character.width
+
+    if (mode or config.OVERLAY_MODE) == "warp":
+        # Exact scale and angle, rendered later in a single warp
+        character_rotated = None
+        sprite_width, sprite_height = rotated_size(
+            int(character.width * scale_factor), int(character.height * scale_factor), angle_degrees
+        )
+    else:
+        # Resize and rotate to match the face, reusing a cached sprite when one is close enough
+        character_rotated = sprite_cache.get(character, scale_factor, angle_degrees)
+        sprite_height, sprite_width = character_rotated.shape[:2]
+
+    # Improved positioning - center on the entire face area
+    face_center_x = face_rect[0] + face_rect[2] // 2
+    face_center_y = face_rect[1] + face_rect[3] // 2
+
+    # Adjust position slightly upward for better alignment
+    paste_x = face_center_x - sprite_width // 2
+    paste_y = face_center_y - sprite_height // 2 - int(face_height * 0.1)
+
+    # Ensure paste position is within image bounds
+    paste_x = max(0, min(paste_x, frame_width - sprite_width))
+    paste_y = max(0, min(paste_y, frame_height - sprite_height))
+
+    # Blend the premultiplied sprite over just the region it covers
+    result = base_image.copy() if copy else base_image
+    if character_rotated is None:
+        source = character.level_for(int(character.width * scale_factor), int(character.height * scale_factor))
+        level_scale = scale_factor * character.width / source.shape[1]
+        return warp_blend(result, source, level_scale, angle_degrees,
+                          (paste_x, paste_y), (sprite_width, sprite_height))
+    return blend_premultiplied(result, character_rotated, paste_x, paste_y)
+
+
+def add_lover_image(image, lover, copy=True):
+    """Add lover image as a floating element"""
+    # Improved scaling for lover image
+    # Scale based on image size for better proportions
+    base_height, base_width = image.shape[:2]
+    lover_scale = min(base_width / lover.width * 0.25, base_height / lover.height * 0.35)
+
+    lover_width = int(lover.width * lover_scale)
+    lover_height = int(lover.height * lover_scale)
+
+    # Ensure minimum and maximum sizes
+    min_size, max_size = 100, 300
+    if lover_width < min_size:
+        scale_factor = min_size / lover_width
+        lover_width = min_size
+        lover_height = int(lover_height * scale_factor)
+    elif lover_width > max_size:
+        scale_factor = max_size / lover_width
+        lover_width = max_size
+        lover_height = int(lover_height * scale_factor)
+
+    lover_resized = sprite_cache.get(lover, lover_width / lover.width)
+    lover_height, lover_width = lover_resized.shape[:2]
+
+    # Better positioning - top right with elegant placement
+    margin_x = 30
+    margin_y = 30
+    paste_x = base_width - lover_width - margin_x
+    paste_y = margin_y
+
+    # Ensure position is within bounds
+    paste_x = max(0, min(paste_x, base_width - lover_width))
+    paste_y = max(0, min(paste_y, base_height - lover_height))
+
+    # Apply lover image with transparency
+    result = image.copy() if copy else image
+    return blend_premultiplied(result, lover_resized, paste_x, paste_y)
+
+
+INVALID_FORMAT = "Invalid image format. Please use JPG, PNG, or other common formats."
+
+
+def check_dimensions(w, h):
+    """Enforce the minimum and maximum image size"""
+    if w < config.MIN_IMAGE_DIM or h < config.MIN_IMAGE_DIM:
+        raise PipelineError(400, f"Image too small (minimum {config.MIN_IMAGE_DIM}x{config.MIN_IMAGE_DIM} pixels)")
+
+    if w > config.MAX_IMAGE_DIM or h > config.MAX_IMAGE_DIM or w * h > config.MAX_IMAGE_PIXELS:
+        raise PipelineError(400, f"Image too large (maximum {config.MAX_IMAGE_DIM}x{config.MAX_IMAGE_DIM} pixels)")
+
+
+def inspect_upload(contents):
+    """Check format and dimensions from the header alone, before any pixel decode"""
+    try:
+        info = probe_image(contents)
+    except ProbeError:
+        raise PipelineError(400, INVALID_FORMAT)
+    check_dimensions(info.width, info.height)
+    return info
+
+
+# JPEG can be decoded at 1/2, 1/4 or 1/8 scale straight from the DCT coefficients
+REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+
+
+def decode_flag(info, max_edge):
+    """imdecode flag that decodes as small as possible while staying at or above max_edge"""
+    if max_edge and info.format == "jpeg":
+        long_edge = max(info.width, info.height)
+        for factor, flag in REDUCED_DECODE_FLAGS:
+            if long_edge // factor >= max_edge:
+                return flag
+    return cv2.IMREAD_COLOR
+
+
+def fit_working_size(image, max_edge):
+    """Downscale an image so its long edge is at most max_edge"""
+    height, width = image.shape[:2]
+    if not max_edge or max(width, height) <= max_edge:
+        return image
+    scale = max_edge / max(width, height)
+    # INTER_AREA is needed against aliasing on big reductions but is slow on small ones
+    interpolation = cv2.INTER_AREA if scale <= 0.5 else cv2.INTER_LINEAR
+    return cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                      interpolation=interpolation)
+
+
+def decode_image(contents, info=None, max_edge=None):
+    """Decode upload bytes into a BGR image and check its dimensions
+
+    Images larger than max_edge (default MAX_WORKING_EDGE) are decoded at a
+    reduced JPEG scale where possible and then downscaled to fit, so the
+    rest of the pipeline runs at the working resolution.
+    """
+    max_edge = config.MAX_WORKING_EDGE if max_edge is None else max_edge
+
+    # Reject bad formats and decompression bombs before decoding
+    if info is None:
+        info = inspect_upload(contents)
+
+    # Decode image
+    nparr = np.frombuffer(contents, np.uint8)
+    flag = decode_flag(info, max_edge)
+    image = cv2.imdecode(nparr, flag)
+
+    if image is None:
+        raise PipelineError(400, INVALID_FORMAT)
+
+    # Check image dimensions, the header was already checked for reduced decodes
+    if flag == cv2.IMREAD_COLOR:
+        h, w = image.shape[:2]
+        check_dimensions(w, h)
+
+    return fit_working_size(image, max_edge)
+
+
+def init_worker(cv_threads=1, ready=None):
+    """Process pool initializer: set up cascades, OpenCV threads and assets once per worker
+
+    Puts the worker's pid on the ready queue when done, so the server only
+    signals workers whose handlers are installed.
+    """
+    # Workers need their own writer thread, a forked one is not running here
+    setup_logging()
+    # Lets the server's profile endpoint sample this worker too
+    install_signal_handler()
+    cv2.setNumThreads(cv_threads)
+    if face_cascade.empty() or eye_cascade.empty():
+        raise RuntimeError("Failed to load Haar cascades in pipeline worker")
+    # Forked workers inherit decoded assets, spawned ones load or map them here
+    ensure_assets()
+    # Workers keep their own registry, so they follow asset changes themselves
+    asset_registry.start_watching()
+    if ready is not None:
+        ready.put(os.getpid())
+
+
+def ensure_assets():
+    """Load assets on first use in worker processes that did not inherit them"""
+    assets = asset_registry.snapshot()
+    if not assets.characters:
+        assets = asset_registry.load()
+    return assets
+
+
+def resolve_assets(assets, character=None, lover=None):
+    """Look up the chosen assets by name, picking at random when none was chosen
+
+    Names chosen by the server may be missing from a worker's snapshot for a
+    moment around a hot reload; those fall back to a random pick as well.
+    """
+    character = (character and assets.get("character", character)) or get_random_character(assets)
+    if lover is None or assets.get("lover", lover) is None:
+        return character, get_random_lover(assets)
+    return character, assets.get("lover", lover)
+
+
+def analyze_upload(contents, info=None):
+    """Decode an upload and locate its face
+
+    Returns (image, landmarks, detection, timings), detection being the
+    DetectionStrategy info and timings the decode, face and eye detection
+    times in milliseconds.
+    """
+    started = time.perf_counter()
+    image = decode_image(contents, info)
+    decode_ms = (time.perf_counter() - started) * 1000
+
+    # Detect face landmarks, falling back to a centre estimate within the time budget
+    face_landmarks, detection = detection_strategy.detect(image)
+
+    if log.isEnabledFor(logging.DEBUG):
+        h, w = image.shape[:2]
+        log.debug("analyzed upload", extra={"width": w, "height": h, **detection})
+
+    timings = {"decode": decode_ms, "face_detect": detection["face_ms"], "eye_detect": detection["eye_ms"]}
+    return image, face_landmarks, detection, timings
+
+
+def render_result(image, face_landmarks, using_fallback, options=None, character=None, lover=None,
+                  budget_cut=False):
+    """Composite the character and lover onto an analyzed frame and encode it
+
+    image is only read, so a frame kept for rerolls can be rendered again.
+    using_fallback and budget_cut describe how its landmarks were found.
+    """
+    options = options or EncodeOptions()
+
+    # Get the chosen character and lover from one consistent snapshot
+    assets = ensure_assets()
+    character, lover = resolve_assets(assets, character, lover)
+
+    if character is None:
+        raise PipelineError(500, "No character images available. Please add character images to the backend.")
+
+    # Apply character face overlay
+    started = time.perf_counter()
+    result_image = align_and_overlay_face(image, character, face_landmarks)
+    character_ms = (time.perf_counter() - started) * 1000
+
+    # Add lover image if available, drawing onto the copy made above
+    lover_ms = None
+    if lover:
+        started = time.perf_counter()
+        result_image = add_lover_image(result_image, lover, copy=False)
+        lover_ms = (time.perf_counter() - started) * 1000
+
+    try:
+        buffer, encode_ms = encode_image(result_image, options)
+    except RuntimeError:
+        raise PipelineError(500, "Failed to encode result image")
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("rendered result", extra={
+            "character": character.name, "lover": lover.name if lover else None,
+            "bytes": len(buffer), "format": options.format, "preset": options.preset,
+            "character_ms": character_ms, "lover_ms": lover_ms, "encode_ms": encode_ms,
+        })
+
+    result = PipelineResult(
+        buffer, options, using_fallback,
+        character.name, lover.name if lover else None, encode_ms, budget_cut
+    )
+    result.timings["character_overlay"] = character_ms
+    if lover_ms is not None:
+        result.timings["lover_overlay"] = lover_ms
+    return result
+
+
+def process_upload(contents, info=None, options=None, character=None, lover=None, keep_frame=False):
+    """Run decode, detection, compositing and encoding for one upload
+
+    character and lover name the assets to use, as chosen by the caller.
+    keep_frame returns the decoded frame and landmarks with the result,
+    so later rerolls can skip decode and detection.
+    """
+    image, face_landmarks, detection, timings = analyze_upload(contents, info)
+    result = render_result(image, face_landmarks, detection["fallback"], options, character, lover,
+                           detection["budget_cut"])
+    result.timings.update(timings)
+    if keep_frame:
+        result.frame = image
+        result.landmarks = face_landmarks
+    return result
@@ -0,0 +1,103 @@
+"""
+Header-only image probing
+Reads the format and dimensions from JPEG, PNG, WebP and BMP headers so
+invalid or oversized uploads are rejected before any pixels are decoded
+"""
+
+import struct
+from collections import namedtuple
+
+ImageInfo = namedtuple("ImageInfo", ["format", "width", "height"])
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# JPEG start-of-frame markers, which carry the image dimensions
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Markers that stand alone without a length field
+JPEG_STANDALONE_MARKERS = {0x01, 0xD8} | set(range(0xD0, 0xD8))
+
+
+class ProbeError(ValueError):
+    """The data is not an image in a supported format, or its header is broken"""
+
+
+def _probe_jpeg(data):
+    offset = 2
+    size = len(data)
+    while offset < size:
+        if data[offset] != 0xFF:
+            raise ProbeError("corrupt JPEG marker")
+        # Skip fill bytes between markers
+        while offset < size and data[offset] == 0xFF:
+            offset += 1
+        if offset >= size:
+            break
+        marker = data[offset]
+        offset += 1
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker in (0xD9, 0xDA):
+            # End of image or start of scan before any frame header
+            break
+        if offset + 2 > size:
+            break
+        (length,) = struct.unpack_from(">H", data, offset)
+        if marker in JPEG_SOF_MARKERS:
+            if offset + 7 > size:
+                break
+            height, width = struct.unpack_from(">HH", data, offset + 3)
+            return ImageInfo("jpeg", width, height)
+        offset += length
+    raise ProbeError("JPEG has no frame header")
+
+
+def _probe_png(data):
+    if len(data) < 24 or data[12:16] != b"IHDR":
+        raise ProbeError("PNG has no IHDR chunk")
+    width, height = struct.unpack_from(">II", data, 16)
+    return ImageInfo("png", width, height)
+
+
+def _probe_webp(data):
+    chunk = data[12:16]
+    if chunk == b"VP8 " and len(data) >= 30:
+        if data[23:26] != b"\x9d\x01\x2a":
+            raise ProbeError("corrupt WebP VP8 frame")
+        width, height = struct.unpack_from("<HH", data, 26)
+        return ImageInfo("webp", width & 0x3FFF, height & 0x3FFF)
+    if chunk == b"VP8L" and len(data) >= 25:
+        if data[20] != 0x2F:
+            raise ProbeError("corrupt WebP VP8L header")
+        (bits,) = struct.unpack_from("<I", data, 21)
+        return ImageInfo("webp", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+    if chunk == b"VP8X" and len(data) >= 30:
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+        return ImageInfo("webp", width, height)
+    raise ProbeError("unsupported WebP chunk")
+
+
+def _probe_bmp(data):
+    if len(data) < 26:
+        raise ProbeError("truncated BMP header")
+    width, height = struct.unpack_from("<ii", data, 18)
+    # Negative height marks a top-down bitmap
+    return ImageInfo("bmp", abs(width), abs(height))
+
+
+def probe_image(data):
+    """Return the ImageInfo of an encoded image from its header alone
+
+    Only the header bytes are touched; JPEG segments are skipped by their
+    lengths, so large EXIF blocks before the frame header cost nothing.
+    """
+    head = memoryview(data).cast("B") if not isinstance(data, (bytes, bytearray)) else data
+    if head[:3] == b"\xff\xd8\xff":
+        return _probe_jpeg(head)
+    if head[:8] == PNG_SIGNATURE:
+        return _probe_png(head)
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return _probe_webp(head)
+    if head[:2] == b"BM":
+        return _probe_bmp(head)
+    raise ProbeError("unrecognised image format")
@@ -0,0 +1,197 @@
+"""
+On-demand sampling profiler for the running server
+Samples the Python stacks of every thread with sys._current_frames for a
+fixed time and writes them as collapsed stacks or a speedscope profile,
+without attaching anything from outside the process
+"""
+
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+import config
+
+FORMATS = {"collapsed": ".collapsed.txt", "speedscope": ".speedscope.json"}
+
+# Longest run accepted, so a typo cannot leave a sampler running for hours
+MAX_SECONDS = 300
+
+log = logging.getLogger(__name__)
+
+
+class ProfilerBusy(Exception):
+    """A profile is already being recorded in this process"""
+
+
+class SamplingProfiler:
+    """Samples all threads' stacks in a background thread, one run at a time"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self.last_path = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds=None, interval_ms=None, format=None, directory=None):
+        """Start sampling in the background and return the path the profile will be written to"""
+        seconds = min(config.PROFILE_SECONDS if seconds is None else seconds, MAX_SECONDS)
+        interval = (config.PROFILE_INTERVAL_MS if interval_ms is None else interval_ms) / 1000
+        format = format or config.PROFILE_FORMAT
+        directory = directory or config.PROFILE_DIR
+        if format not in FORMATS:
+            raise ValueError(f"Unknown profile format {format!r}, expected one of {', '.join(FORMATS)}")
+        if seconds <= 0 or interval <= 0:
+            raise ValueError("seconds and interval must be positive")
+
+        with self._lock:
+            if self.running:
+                raise ProfilerBusy("a profile is already running")
+            os.makedirs(directory, exist_ok=True)
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            path = os.path.join(directory, f"profile-{os.getpid()}-{stamp}{FORMATS[format]}")
+            self._thread = threading.Thread(
+                target=self._run, args=(seconds, interval, format, path),
+                name="sampling-profiler", daemon=True
+            )
+            self._thread.start()
+        log.info("profiler started", extra={"seconds": seconds, "interval_ms": interval * 1000, "path": path})
+        return path
+
+    def _run(self, seconds, interval, format, path):
+        samples, sampled_for = sample_stacks(seconds, interval)
+        try:
+            if format == "speedscope":
+                write_speedscope(path, samples, interval, sampled_for)
+            else:
+                write_collapsed(path, samples)
+        except OSError:
+            log.exception("could not write profile", extra={"path": path})
+            return
+        self.last_path = path
+        log.info("profile written", extra={"path": path, "samples": sum(samples.values())})
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def sample_stacks(seconds, interval):
+    """Count (thread name, root-to-leaf frames) stacks over all threads but this one"""
+    me = threading.get_ident()
+    samples = Counter()
+    started = time.perf_counter()
+    deadline = started + seconds
+    next_tick = started
+    while True:
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.reverse()
+            samples[(names.get(ident, str(ident)), tuple(stack))] += 1
+        # Fixed-rate ticks, skipping ahead instead of bursting after a stall
+        next_tick += interval
+        if next_tick < now:
+            next_tick = now + interval
+        time.sleep(max(0.0, next_tick - time.perf_counter()))
+    return samples, time.perf_counter() - started
+
+
+def write_collapsed(path, samples):
+    """Brendan Gregg's collapsed format: 'thread;frame;frame count' per line"""
+    with open(path, "w") as f:
+        for (thread, stack), count in samples.most_common():
+            f.write(";".join((thread,) + stack).replace(" ", "_") + f" {count}\n")
+
+
+def write_speedscope(path, samples, interval, duration):
+    """speedscope's sampled-profile JSON, one profile per thread"""
+    frames = []
+    frame_index = {}
+    profiles = {}
+    for (thread, stack), count in samples.items():
+        indices = []
+        for name in stack:
+            if name not in frame_index:
+                frame_index[name] = len(frames)
+                frames.append({"name": name})
+            indices.append(frame_index[name])
+        profile = profiles.setdefault(thread, {"samples": [], "weights": []})
+        profile["samples"].append(indices)
+        profile["weights"].append(count * interval)
+
+    document = {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": [
+            {
+                "type": "sampled",
+                "name": thread,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": duration,
+                "samples": profile["samples"],
+                "weights": profile["weights"],
+            }
+            for thread, profile in sorted(profiles.items())
+        ],
+        "name": f"magadheera pid {os.getpid()}",
+        "exporter": "magadheera profiler",
+    }
+    with open(path, "w") as f:
+        json.dump(document, f)
+
+
+# One profiler per process
+profiler = SamplingProfiler()
+
+# Set by the signal handler, which must not take locks that the code it
+# interrupted may hold; a trigger thread does the actual start
+_signalled = threading.Event()
+_trigger = None
+
+
+def _on_signal(signum, frame):
+    _signalled.set()
+
+
+def _trigger_loop():
+    while True:
+        _signalled.wait()
+        _signalled.clear()
+        try:
+            profiler.start()
+        except ProfilerBusy:
+            log.info("profiler already running, signal ignored")
+
+
+def install_signal_handler():
+    """Start a default-length profile on SIGUSR2, where the platform and thread allow it"""
+    global _trigger
+    if not hasattr(signal, "SIGUSR2"):
+        return False
+    try:
+        signal.signal(signal.SIGUSR2, _on_signal)
+    except ValueError:
+        # Only the main thread may install handlers, e.g. not under a test client
+        return False
+    if _trigger is None or not _trigger.is_alive():
+        _trigger = threading.Thread(target=_trigger_loop, name="profiler-trigger", daemon=True)
+        _trigger.start()
+    return True
@@ -0,0 +1,88 @@
+"""
+Responses for encoded result images
+Sends the encoder's buffer as-is through a memoryview, with a proper
+Content-Length, a strong ETag and HEAD / If-None-Match handling
+"""
+
+import hashlib
+
+from fastapi.responses import Response
+
+
+def body_view(buffer):
+    """Flat byte view over an encoded buffer without copying it"""
+    return memoryview(buffer).cast("B")
+
+
+def strong_etag(body):
+    """Strong ETag derived from the exact response bytes"""
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header value covers etag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison, as If-None-Match requires
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+# Server-Timing metrics and the pipeline stages each one sums
+SERVER_TIMING_STAGES = (
+    ("decode", ("decode",)),
+    ("detect", ("face_detect", "eye_detect")),
+    ("composite", ("character_overlay", "lover_overlay")),
+    ("encode", ("encode",)),
+)
+
+
+def server_timing(timings, cache_status):
+    """Server-Timing header value for a result's stage timings in ms"""
+    entries = []
+    for name, stages in SERVER_TIMING_STAGES:
+        present = [timings[stage] for stage in stages if stage in timings]
+        if present:
+            entries.append(f"{name};dur={sum(present):.1f}")
+    entries.append(f'cache;desc="{cache_status}"')
+    return ", ".join(entries)
+
+
+class ImageResponse(Response):
+    """Response whose body is a memoryview; starlette sends it without copying"""
+
+    def render(self, content):
+        if content is None:
+            return b""
+        return content if isinstance(content, (bytes, memoryview)) else body_view(content)
+
+
+def precondition_response(request, etag, headers=None):
+    """Response for a request whose If-None-Match covers etag, else None
+
+    304 for GET and HEAD; RFC 9110 requires 412 for any other method.
+    """
+    if not etag_matches(request.headers.get("if-none-match"), etag):
+        return None
+    if request.method in ("GET", "HEAD"):
+        return Response(status_code=304, headers={**(headers or {}), "ETag": etag})
+    return Response(status_code=412, headers={**(headers or {}), "ETag": etag})
+
+
+def image_response(request, buffer, media_type, headers=None, etag=None):
+    """Answer with an encoded image, honouring HEAD and If-None-Match"""
+    body = body_view(buffer)
+    headers = dict(headers or {})
+    headers["ETag"] = etag or strong_etag(body)
+
+    response = precondition_response(request, headers["ETag"], headers)
+    if response is not None:
+        return response
+
+    if request.method == "HEAD":
+        headers["Content-Length"] = str(body.nbytes)
+        return Response(status_code=200, media_type=media_type, headers=headers)
+
+    return ImageResponse(body, media_type=media_type, headers=headers)
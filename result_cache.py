@@ -0,0 +1,239 @@
+"""
+Content-addressed cache of encoded results
+Results are keyed by the upload's hash, the chosen assets and the output
+options, kept in a byte-budgeted LRU and optionally spilled to a local
+directory so they survive restarts
+"""
+
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import config
+
+# Disk entry layout: meta length, JSON meta, then the encoded bytes
+DISK_HEADER = struct.Struct("<I")
+DISK_SUFFIX = ".result"
+
+log = logging.getLogger(__name__)
+
+
+def pipeline_settings():
+    """Settings that change the output for the same upload, assets and options"""
+    return (config.OVERLAY_MODE, config.MAX_WORKING_EDGE, config.DETECT_MAX_EDGE,
+            config.DETECT_REFINE_EYES, config.DETECT_BUDGET_MS, config.SPRITE_SCALE_STEP,
+            config.SPRITE_ANGLE_STEP)
+
+
+def result_key(digest, character, lover, options):
+    """Cache key for one pipeline run, also used as the result's strong ETag"""
+    parts = (
+        digest,
+        (character.name, character.digest) if character else None,
+        (lover.name, lover.digest) if lover else None,
+        options.key(),
+        pipeline_settings(),
+    )
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+class CachedResult:
+    """An encoded result and the metadata its response headers need"""
+
+    def __init__(self, buffer, media_type, extension, using_fallback, character, lover, budget_cut=False):
+        # Shared between responses, so never written to
+        self.buffer = buffer
+        self.buffer.flags.writeable = False
+        self.media_type = media_type
+        self.extension = extension
+        self.using_fallback = using_fallback
+        self.character = character
+        self.lover = lover
+        # Only set on results that are never cached, so not part of meta()
+        self.budget_cut = budget_cut
+
+    @classmethod
+    def from_result(cls, result):
+        return cls(result.buffer, result.media_type, result.extension,
+                   result.using_fallback, result.character, result.lover, result.budget_cut)
+
+    @property
+    def nbytes(self):
+        return self.buffer.nbytes
+
+    def meta(self):
+        return {
+            "media_type": self.media_type,
+            "extension": self.extension,
+            "using_fallback": self.using_fallback,
+            "character": self.character,
+            "lover": self.lover,
+        }
+
+
+class ResultCache:
+    """Byte-budgeted LRU of CachedResults with an optional on-disk tier"""
+
+    def __init__(self, max_bytes=None, disk_dir=None, disk_max_bytes=None):
+        self.max_bytes = config.RESULT_CACHE_MB * 1024 * 1024 if max_bytes is None else max_bytes
+        self.disk_dir = config.RESULT_CACHE_DIR if disk_dir is None else disk_dir
+        self.disk_max_bytes = (config.RESULT_CACHE_DISK_MB * 1024 * 1024
+                               if disk_max_bytes is None else disk_max_bytes)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_hits = 0
+        self.disk_bytes = 0
+        self.disk_entries = 0
+        self.disk_evictions = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            for _, size, _ in self._disk_files():
+                self.disk_bytes += size
+                self.disk_entries += 1
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 or bool(self.disk_dir)
+
+    def get(self, key):
+        """Return the CachedResult for key from memory or disk, or None"""
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+
+        result = self._read_disk(key) if self.disk_dir else None
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+        # Promote so the next hit skips the disk
+        self._put_memory(key, result)
+        return result
+
+    def put(self, key, result):
+        """Store a CachedResult in memory and, when configured, on disk"""
+        self._put_memory(key, result)
+        if self.disk_dir:
+            self._write_disk(key, result)
+
+    def _put_memory(self, key, result):
+        size = result.nbytes
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = result
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        """Drop the in-memory tier; the disk tier is left in place"""
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key + DISK_SUFFIX)
+
+    def _disk_files(self):
+        """(path, size, mtime) of every entry in the disk tier"""
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.is_file() and entry.name.endswith(DISK_SUFFIX):
+                stat = entry.stat()
+                files.append((entry.path, stat.st_size, stat.st_mtime_ns))
+        return files
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # Touch the entry so disk eviction sees it as recently used
+            os.utime(path)
+        except OSError:
+            return None
+        (meta_len,) = DISK_HEADER.unpack_from(data)
+        meta = json.loads(data[DISK_HEADER.size:DISK_HEADER.size + meta_len])
+        buffer = np.frombuffer(data, dtype=np.uint8, offset=DISK_HEADER.size + meta_len)
+        return CachedResult(buffer, **meta)
+
+    def _write_disk(self, key, result):
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        meta = json.dumps(result.meta()).encode("utf-8")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(DISK_HEADER.pack(len(meta)))
+                f.write(meta)
+                f.write(result.buffer)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log.warning("could not write result cache entry", extra={"key": key, "error": str(e)})
+            return
+        with self._lock:
+            self.disk_bytes += DISK_HEADER.size + len(meta) + result.nbytes
+            self.disk_entries += 1
+            over_budget = self.disk_bytes > self.disk_max_bytes
+        if over_budget:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """Delete the least recently used disk entries until back under budget"""
+        files = sorted(self._disk_files(), key=lambda item: item[2])
+        total = sum(size for _, size, _ in files)
+        evicted = 0
+        for path, size, _ in files:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        with self._lock:
+            self.disk_bytes = total
+            self.disk_entries = len(files) - evicted
+            self.disk_evictions += evicted
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "disk": {
+                "enabled": bool(self.disk_dir),
+                "entries": self.disk_entries,
+                "bytes": self.disk_bytes,
+                "max_bytes": self.disk_max_bytes,
+                "hits": self.disk_hits,
+                "evictions": self.disk_evictions,
+            },
+        }
@@ -0,0 +1,48 @@
+"""
+Deterministic character and lover selection
+Picks assets from a seed by rendezvous hashing, so the same seed or upload
+always gets the same pair and adding an image only moves the seeds that
+now prefer it
+"""
+
+import hashlib
+import random
+
+import config
+
+
+def content_digest(contents):
+    """Hex digest identifying an upload by its bytes"""
+    return hashlib.blake2b(contents, digest_size=16).hexdigest()
+
+
+def selection_seed(seed=None, digest=None):
+    """Seed for choose_assets: the request's own, the upload's hash, or None for random"""
+    if seed:
+        return f"seed:{seed}"
+    if config.SELECTION_MODE == "content" and digest:
+        return f"content:{digest}"
+    return None
+
+
+def _weight(seed, asset):
+    key = f"{seed}/{asset.kind}/{asset.name}".encode()
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big")
+
+
+def pick(assets, seed=None):
+    """The asset a seed prefers, or a random one without a seed"""
+    if not assets:
+        return None
+    if seed is None:
+        return random.choice(assets)
+    return max(assets, key=lambda asset: _weight(seed, asset))
+
+
+def choose_assets(asset_set, seed=None, exclude=()):
+    """(character, lover) for a seed from one asset snapshot
+
+    Characters named in exclude are skipped unless nothing else is left.
+    """
+    characters = [c for c in asset_set.characters if c.name not in exclude] or asset_set.characters
+    return pick(characters, seed), pick(asset_set.lovers, seed)
@@ -0,0 +1,143 @@
+"""
+Reroll sessions for processed uploads
+Keeps each upload's decoded frame and face landmarks for a while, so
+picking another character redoes only selection, compositing and encoding.
+With a process pool, frames would be pickled back from the workers on
+every upload, so sessions keep only the upload and rerolls analyze it again.
+"""
+
+import secrets
+import time
+from collections import OrderedDict
+
+import config
+
+
+class Session:
+    """One upload's analysis and the characters it has been shown with"""
+
+    def __init__(self, session_id, digest, contents, info, seed, character):
+        self.id = session_id
+        self.digest = digest
+        # The upload itself, until its frame is attached
+        self.contents = contents
+        self.info = info
+        self.seed = seed
+        self.frame = None
+        self.landmarks = None
+        self.using_fallback = None
+        self.budget_cut = False
+        self.seen = [character] if character else []
+        self.rerolls = 0
+        self.expires = 0.0
+
+    @property
+    def analyzed(self):
+        return self.frame is not None
+
+    def attach(self, frame, landmarks, using_fallback, budget_cut=False):
+        """Keep the decoded frame and landmarks, dropping the encoded upload"""
+        # Shared with every render from this session, and possibly other sessions
+        frame.flags.writeable = False
+        self.frame = frame
+        self.landmarks = landmarks
+        self.using_fallback = using_fallback
+        self.budget_cut = budget_cut
+        self.contents = None
+
+    def next_seed(self):
+        """Seed for the next reroll, so reroll n of an upload is reproducible"""
+        self.rerolls += 1
+        return f"{self.seed}/reroll/{self.rerolls}" if self.seed else None
+
+    def shown(self, character, total):
+        """Record a character, starting over once every one of total has been shown"""
+        self.seen.append(character)
+        if len(self.seen) >= total:
+            self.seen = [character]
+
+    @property
+    def nbytes(self):
+        if self.frame is not None:
+            return self.frame.nbytes
+        return len(self.contents) if self.contents is not None else 0
+
+
+class SessionStore:
+    """Sessions by id, expiring TTL seconds after last use, within a byte budget"""
+
+    def __init__(self, ttl=None, max_bytes=None):
+        self.ttl = config.SESSION_TTL if ttl is None else ttl
+        self.max_bytes = config.SESSION_CACHE_MB * 1024 * 1024 if max_bytes is None else max_bytes
+        # Least recently used first, which is also soonest to expire
+        self._sessions = OrderedDict()
+        self._sizes = {}
+        self.bytes = 0
+        self.created = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_bytes > 0
+
+    def create(self, digest, contents, info, seed, character):
+        """Start a session for an upload, returning it"""
+        session = Session(secrets.token_urlsafe(16), digest, contents, info, seed, character)
+        self.created += 1
+        self._sessions[session.id] = session
+        self._sizes[session.id] = 0
+        self.touch(session)
+        return session
+
+    def get(self, session_id):
+        """The live session with this id, or None if unknown or expired"""
+        self._purge()
+        session = self._sessions.get(session_id)
+        if session is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.touch(session)
+        return session
+
+    def touch(self, session):
+        """Extend a session's lifetime and account for its current size"""
+        if session.id not in self._sessions:
+            return
+        session.expires = time.monotonic() + self.ttl
+        self._sessions.move_to_end(session.id)
+        self.bytes += session.nbytes - self._sizes[session.id]
+        self._sizes[session.id] = session.nbytes
+        while self.bytes > self.max_bytes and len(self._sessions) > 1:
+            self._drop(next(iter(self._sessions)))
+            self.evictions += 1
+
+    def _drop(self, session_id):
+        self._sessions.pop(session_id)
+        self.bytes -= self._sizes.pop(session_id)
+
+    def _purge(self):
+        now = time.monotonic()
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.expires > now:
+                break
+            self._drop(session.id)
+            self.expired += 1
+
+    def stats(self):
+        self._purge()
+        return {
+            "entries": len(self._sessions),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "created": self.created,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+        }
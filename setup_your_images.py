@@ -128,7 +128,8 @@ def show_manual_instructions():
    - High quality, good lighting
 
 🔄 AFTER ADDING IMAGES:
-   1. Restart the backend server: python app.py
+   1. A running backend picks them up within a few seconds, no restart needed
+      (if backend/assets.bundle exists, rebuild it: python build_asset_bundle.py)
    2. Test the app: http://localhost:3000
    3. Your custom images will now be used!
 
@@ -81,7 +81,9 @@ def main():
             host="0.0.0.0",
             port=8000,
             reload=True,
-            log_level="info"
+            log_level="info",
+            # The app queues all logging itself, see logs.setup_logging
+            log_config=None
         )
     except KeyboardInterrupt:
         print("\n👋 Server stopped by user")
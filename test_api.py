@@ -97,6 +97,26 @@ def test_image_processing():
         print(f"❌ Image processing error: {e}")
         return False
 
+def test_oversize_upload_cors():
+    """Test that a too-large upload is rejected with an error the frontend can read"""
+    try:
+        # Just over the default 10MB limit plus multipart overhead
+        files = {'file': ('big.jpg', io.BytesIO(b'\xff' * (11 * 1024 * 1024)), 'image/jpeg')}
+        response = requests.post('http://localhost:8000/process-image', files=files,
+                                 headers={'Origin': 'http://localhost:3000'})
+
+        allowed = response.headers.get('access-control-allow-origin')
+        if response.status_code == 400 and allowed:
+            print("✅ Oversize upload rejected with CORS headers")
+            print(f"   Error: {response.json().get('detail')}")
+            return True
+        print(f"❌ Oversize upload: status {response.status_code}, Access-Control-Allow-Origin {allowed!r}")
+        return False
+
+    except Exception as e:
+        print(f"❌ Oversize upload error: {e}")
+        return False
+
 def main():
     print("🧪 Testing Magadheera Past Life Reveal API")
     print("=" * 50)
@@ -112,9 +132,13 @@ def main():
     # Test image processing
     print("\n2. Testing image processing...")
     processing_ok = test_image_processing()
+
+    # Test upload size limit
+    print("\n3. Testing oversize upload rejection...")
+    oversize_ok = test_oversize_upload_cors()
     
     print("\n" + "=" * 50)
-    if health_ok and processing_ok:
+    if health_ok and processing_ok and oversize_ok:
         print("🎉 All tests passed! The API is working correctly.")
         print("💡 You can now use the frontend at http://localhost:3000")
     else:
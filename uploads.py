@@ -0,0 +1,138 @@
+"""
+Incremental upload readers with early size rejection
+Bodies are read chunk by chunk into a preallocated buffer and abandoned as
+soon as they cross the upload limit, instead of being buffered whole first.
+UploadSizeLimit applies the same limit to multipart bodies as they arrive.
+"""
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+import config
+from pipeline import PipelineError
+
+CHUNK_SIZE = 64 * 1024
+
+# Allowance for multipart boundaries and part headers around the file
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+def max_upload_bytes():
+    return config.MAX_UPLOAD_MB * 1024 * 1024
+
+
+def too_large():
+    return PipelineError(400, f"File too large (max {config.MAX_UPLOAD_MB}MB)")
+
+
+def check_declared_size(size):
+    """Reject up front when the client already told us the body is too big"""
+    if size is not None and size > max_upload_bytes():
+        raise too_large()
+
+
+async def read_chunks(chunks, size_hint=None):
+    """Collect an async iterator of byte chunks into one bytearray, enforcing the limit"""
+    limit = max_upload_bytes()
+    buffer = bytearray(min(size_hint or CHUNK_SIZE, limit))
+    length = 0
+
+    async for chunk in chunks:
+        end = length + len(chunk)
+        if end > limit:
+            raise too_large()
+        if end > len(buffer):
+            # Size was unknown or understated, grow geometrically up to the limit
+            capacity = min(max(len(buffer) * 2, end), limit)
+            buffer.extend(bytes(capacity - len(buffer)))
+        buffer[length:end] = chunk
+        length = end
+
+    if length == 0:
+        raise PipelineError(400, "Empty file")
+    # Trim in place, the pipeline only needs a bytes-like object
+    del buffer[length:]
+    return buffer
+
+
+async def _upload_chunks(file):
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def read_upload(file):
+    """Read a multipart UploadFile incrementally"""
+    check_declared_size(file.size)
+    return await read_chunks(_upload_chunks(file), file.size)
+
+
+async def read_request_body(request):
+    """Read a raw request body straight off the connection"""
+    declared = request.headers.get("content-length")
+    size = int(declared) if declared and declared.isdigit() else None
+    check_declared_size(size)
+    return await read_chunks(request.stream(), size)
+
+
+class UploadSizeLimit:
+    """ASGI middleware capping request bodies on upload paths while they arrive
+
+    Multipart bodies are parsed and spooled before the endpoint runs, and a
+    chunked body has no Content-Length to check, so the bytes are counted
+    as the app receives them and the request fails once past the limit.
+    """
+
+    def __init__(self, app, path_prefix, overhead=MULTIPART_OVERHEAD):
+        self.app = app
+        self.path_prefix = path_prefix
+        self.overhead = overhead
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["method"] != "POST"
+                or not scope["path"].startswith(self.path_prefix)):
+            return await self.app(scope, receive, send)
+
+        limit = max_upload_bytes() + self.overhead
+        declared = dict(scope["headers"]).get(b"content-length", b"")
+        if declared.isdigit() and int(declared) > limit:
+            # Told up front, so answer before reading any of the body
+            return await self._reject(scope, receive, send)
+
+        received = 0
+        exceeded = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    error = too_large()
+                    raise HTTPException(status_code=error.status_code, detail=error.detail)
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            # The form parser may report the abort as its own error, answer with ours instead
+            if exceeded and not started:
+                return
+            started = started or message["type"] == "http.response.start"
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded or started:
+                raise
+        if exceeded and not started:
+            await self._reject(scope, receive, send)
+
+    async def _reject(self, scope, receive, send):
+        error = too_large()
+        response = JSONResponse(status_code=error.status_code, content={"detail": error.detail})
+        await response(scope, receive, send)